@@ -0,0 +1,43 @@
+import argparse
+import timeit
+import numpy as np
+import pandas as pd
+from commons.constants import CANDLE_CLOSE_COLUMN
+from indicator.volatility import bbands, bbands_grid_chunks
+from signals.bollinger import boll_trend, boll_trend_grid
+
+
+def simulate_close(bars, price=30000, tick=0.1, seed=0):
+    """
+    生成模拟收盘价，按最小价格变动单位取整，与真实K线一样存在大量相同价格
+    """
+    rng = np.random.default_rng(seed)
+    close = price * np.exp(np.cumsum(rng.normal(0, 0.001, bars)))
+    return np.round(close / tick) * tick
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='check bbands_grid and boll_trend_grid against bbands and boll_trend')
+    parser.add_argument('-n', '--bars', type=int, default=3000000, help='candle number, default: 3000000')
+    parser.add_argument('-p', '--periods', type=int, nargs='+', default=[10, 100, 1000], help='periods, default: 10 100 1000')
+    parser.add_argument('-w', '--widths', type=float, nargs='+', default=[0.5, 2, 5], help='widths, default: 0.5 2 5')
+    parser.add_argument('-m', '--max-bytes', type=int, default=2 ** 30, help='max bytes of each chunk, default: 1GiB')
+    args = parser.parse_args()
+
+    print(f'Run check with arguments: {args}')
+    close = simulate_close(args.bars)
+    mismatched = 0
+    start_time = timeit.default_timer()
+    for periods, widths, (bbm, bbu, bbl, _) in bbands_grid_chunks(close, args.periods, args.widths, max_bytes=args.max_bytes):
+        signal_long, signal_short = boll_trend_grid(close, bbm, bbu, bbl)
+        for i, period in enumerate(periods):
+            for j, width in enumerate(widths):
+                expected = boll_trend(bbands(pd.DataFrame({CANDLE_CLOSE_COLUMN: close}), period=period, width=width))
+                std = (expected['BBU'] - expected['BBM']).to_numpy() / width
+                actual_std = (bbu[:, i, j] - bbm[:, i]) / width
+                error = np.nanmax(np.abs(actual_std - std) / np.where(std > 0, std, np.nan))
+                diff = (np.count_nonzero(~np.isclose(signal_long[:, i, j], expected['signal_long'], equal_nan=True))
+                        + np.count_nonzero(~np.isclose(signal_short[:, i, j], expected['signal_short'], equal_nan=True)))
+                mismatched += diff
+                print(f'period: {period}, width: {width}, std max relative error: {error:.2e}, mismatched signals: {diff}')
+    print(f'bars: {args.bars}, mismatched signals: {mismatched}, takes {timeit.default_timer() - start_time:.2f}s')
@@ -0,0 +1,79 @@
+import argparse
+import timeit
+import numpy as np
+import pandas as pd
+from commons.constants import CANDLE_DATETIME_COLUMN, CANDLE_OPEN_COLUMN, CANDLE_CLOSE_COLUMN, SIGNAL_COLUMN, POSITION_COLUMN, EQUITY_CHANGE_COLUMN, \
+    EQUITY_CURVE_COLUMN
+from evaluation.statistics import transfer_equity_curve_to_trade
+
+
+def transfer_equity_curve_to_trade_loop(equity_curve):
+    """
+    逐笔交易循环、按单元格写入的原实现，作为对比基准
+    """
+    trade = pd.DataFrame()
+    for _index, group in equity_curve.groupby('start_time'):
+        trade.loc[_index, SIGNAL_COLUMN] = group[POSITION_COLUMN].iloc[0]
+        g = group[group[POSITION_COLUMN] != 0]
+        trade.loc[_index, 'end_bar'] = g.iloc[-1][CANDLE_DATETIME_COLUMN]
+        trade.loc[_index, 'start_price'] = g.iloc[0][CANDLE_OPEN_COLUMN]
+        trade.loc[_index, 'end_price'] = g.iloc[-1][CANDLE_CLOSE_COLUMN]
+        trade.loc[_index, 'bar_num'] = g.shape[0]
+        trade.loc[_index, 'change'] = (group[EQUITY_CHANGE_COLUMN] + 1).prod() - 1
+        trade.loc[_index, 'end_equity_curve'] = g.iloc[-1][EQUITY_CURVE_COLUMN]
+        trade.loc[_index, 'min_equity_curve'] = g[EQUITY_CURVE_COLUMN].min()
+    return trade
+
+
+def simulate_equity_curve(trades, bars_per_trade, flat_bars, seed=0):
+    """
+    生成指定交易笔数的模拟资金曲线，每笔交易持仓bars_per_trade根K线，交易之间空仓flat_bars根K线
+    """
+    rng = np.random.default_rng(seed)
+    period = bars_per_trade + flat_bars
+    n = trades * period
+    close = 10000 * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+    df = pd.DataFrame({
+        CANDLE_DATETIME_COLUMN: pd.date_range('2017-01-01', periods=n, freq='5min', tz='UTC'),
+        CANDLE_OPEN_COLUMN: np.r_[close[0], close[:-1]],
+        CANDLE_CLOSE_COLUMN: close,
+    })
+    # 持仓方向多空交替
+    direction = np.where(np.arange(trades) % 2 == 0, 1, -1)
+    position = np.zeros((trades, period))
+    position[:, :bars_per_trade] = direction[:, None]
+    df[POSITION_COLUMN] = position.ravel()
+    df[EQUITY_CHANGE_COLUMN] = np.where(df[POSITION_COLUMN] != 0, rng.normal(0, 0.002, n), 0)
+    df[EQUITY_CURVE_COLUMN] = (1 + df[EQUITY_CHANGE_COLUMN]).cumprod()
+    df['start_time'] = df[CANDLE_DATETIME_COLUMN].iloc[np.arange(n) // period * period].values
+    df.loc[df[POSITION_COLUMN] == 0, 'start_time'] = pd.NaT
+    return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark equity curve to trade transformation')
+    parser.add_argument('-t', '--trades', type=int, nargs='+', default=[100, 10000, 100000], help='trade numbers, default: 100 10000 100000')
+    parser.add_argument('-b', '--bars-per-trade', type=int, default=20, help='holding bars per trade, default: 20')
+    parser.add_argument('-f', '--flat-bars', type=int, default=5, help='flat bars between trades, default: 5')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='repeat times of the vectorized version, default: 3')
+    parser.add_argument('--baseline-limit', type=int, default=100000,
+                        help='skip the loop baseline when trade number exceeds this limit (about 25 minutes for 100000 trades), default: 100000')
+    args = parser.parse_args()
+
+    print(f'Run benchmark with arguments: {args}')
+    for trades in args.trades:
+        equity_curve = simulate_equity_curve(trades, args.bars_per_trade, args.flat_bars)
+        vectorized = min(timeit.repeat(lambda: transfer_equity_curve_to_trade(equity_curve), number=1, repeat=args.repeat))
+        if trades <= args.baseline_limit:
+            start_time = timeit.default_timer()
+            expected = transfer_equity_curve_to_trade_loop(equity_curve)
+            loop = timeit.default_timer() - start_time
+            actual = transfer_equity_curve_to_trade(equity_curve)
+            columns = ['signal', 'start_price', 'end_price', 'bar_num', 'change', 'end_equity_curve', 'min_equity_curve']
+            matched = (np.allclose(expected[columns].values.astype(np.float64), actual[columns].values)
+                       and pd.DatetimeIndex(expected['end_bar']).equals(pd.DatetimeIndex(actual['end_bar']))
+                       and expected.index.equals(actual.index) and expected.index.name == actual.index.name)
+            print(f'trades: {trades}, rows: {len(equity_curve)}, loop: {loop:.4f}s, vectorized: {vectorized:.4f}s, '
+                  f'speedup: {loop / vectorized:.1f}x, matched: {matched}')
+        else:
+            print(f'trades: {trades}, rows: {len(equity_curve)}, loop: skipped, vectorized: {vectorized:.4f}s')
@@ -1,38 +1,96 @@
 import numpy as np
 import pandas as pd
 from commons.constants import CANDLE_COLUMNS, CANDLE_DATETIME_COLUMN
+from commons.daily_candle_manifest import daily_candle_name
 
+MILLS_PER_DAY = 24 * 60 * 60 * 1000
 
-class DailyCandleCSVWriter:
+
+class DailyCandleWriter:
     """
-    将K线数据按日分割存储为CSV文件
+    将K线数据按日分割存储为CSV（或Parquet）文件
+    K线按时间顺序追加，收到下一日的K线后，之前日期的数据立即写入磁盘，内存中只保留未完成的一天
     """
 
-    def __init__(self, output_folder, symbol, interval):
+    def __init__(self, output_folder, symbol, interval, *, fmt='csv', columns=CANDLE_COLUMNS, dt_column=CANDLE_DATETIME_COLUMN):
+        if fmt not in ('csv', 'parquet'):
+            raise RuntimeError(f'format not supported: {fmt}')
         self._output_folder = output_folder
-        self._symbol = symbol.replace('/', '-')
-        self._interval = interval
-        self._items = None
+        self._file_name = f'{daily_candle_name(symbol, interval)}.{fmt}'
+        self._fmt = fmt
+        self._columns = columns
+        self._dt_column = dt_column
+        self._chunks = []  # 尚未写入磁盘的K线
+        self._first_day = None  # 缓存中最早的日期
+        self._flushed_days = set()
 
     def append(self, payload):
         if not payload:
             return
-        arr = np.array(payload)
-        if self._items is None:
-            self._items = arr
-        else:
-            self._items = np.concatenate((self._items, arr))
+        arr = np.asarray(payload, dtype=np.float64)
+        self._chunks.append(arr)
+        days = arr[:, 0] // MILLS_PER_DAY
+        first_day, last_day = days.min(), days.max()
+        self._first_day = first_day if self._first_day is None else min(self._first_day, first_day)
+        # 最新K线之前的日期已完整
+        if last_day > self._first_day:
+            self._flush(before_day=last_day)
+
+    @property
+    def pending_since(self):
+        """
+        缓存中尚未写入磁盘的最早日期的开始时间（毫秒），没有缓存数据时为None
+        """
+        return None if self._first_day is None else int(self._first_day) * MILLS_PER_DAY
 
-    def save(self, *, columns=CANDLE_COLUMNS, dt_column=CANDLE_DATETIME_COLUMN):
-        df = pd.DataFrame(self._items, columns=columns)
+    def save(self):
+        """
+        写入剩余的缓存数据
+        """
+        self._flush()
+
+    def _flush(self, before_day=None):
+        if not self._chunks:
+            return
+        items = np.concatenate(self._chunks) if len(self._chunks) > 1 else self._chunks[0]
+        self._chunks, self._first_day = [], None
+        if before_day is not None:
+            pending = items[:, 0] // MILLS_PER_DAY >= before_day
+            if pending.any():
+                self._chunks, self._first_day = [items[pending]], before_day
+            items = items[~pending]
+        if len(items) > 0:
+            self._write(items)
 
-        df[dt_column] = pd.to_datetime(df[dt_column], unit='ms', utc=True)  # 时区为UTC
-        df.sort_values(dt_column, inplace=True)
+    def _write(self, items):
+        df = pd.DataFrame(items, columns=self._columns)
+        df[self._dt_column] = pd.to_datetime(df[self._dt_column], unit='ms', utc=True)  # 时区为UTC
+        df.sort_values(self._dt_column, inplace=True)
         df.reset_index(inplace=True, drop=True)
 
-        for name, group in df.groupby(pd.Grouper(key=dt_column, freq='D')):
+        for name, group in df.groupby(pd.Grouper(key=self._dt_column, freq='D')):
+            if group.empty:
+                continue
             # 按交易对，日期创建文件夹
             folder = self._output_folder / name.strftime('%Y-%m-%d')
             folder.mkdir(parents=True, exist_ok=True)
-            # 保存CSV
-            group.to_csv(folder / f'{self._symbol}_{self._interval}.csv', index=False, columns=columns)
+            path = folder / self._file_name
+            if name in self._flushed_days:
+                # 已写入的日期又收到数据，与已有数据合并
+                group = pd.concat([self._read(path), group], ignore_index=True)
+                group.drop_duplicates(subset=[self._dt_column], keep='last', inplace=True)
+                group.sort_values(self._dt_column, inplace=True)
+            self._flushed_days.add(name)
+            if self._fmt == 'parquet':
+                group.to_parquet(path, index=False)
+            else:
+                group.to_csv(path, index=False, columns=self._columns)
+
+    def _read(self, path):
+        if self._fmt == 'parquet':
+            return pd.read_parquet(path)
+        return pd.read_csv(path, parse_dates=[self._dt_column])
+
+
+# 兼容旧名称
+DailyCandleCSVWriter = DailyCandleWriter
@@ -0,0 +1,84 @@
+import os
+from datetime import datetime, timedelta
+import pandas as pd
+import pytz
+from commons.dataframe_utils import time_series_gaps
+
+# 按日保存的K线文件格式
+DAILY_CANDLE_EXTENSIONS = ('.csv', '.parquet')
+
+
+class DailyCandleManifest:
+    """
+    按日保存的K线数据索引，记录每个交易对、K线时长已保存的日期
+    目录结构为：<folder>/<YYYY-MM-DD>/<symbol>_<interval>.csv
+    """
+
+    def __init__(self, folder):
+        self._folder = folder
+        self._files = {}  # 文件名 -> {日期: 文件路径}
+        if not os.path.isdir(folder):
+            return
+        # 只扫描一次目录树
+        for day_entry in os.scandir(folder):
+            if not day_entry.is_dir():
+                continue
+            try:
+                day = datetime.strptime(day_entry.name, '%Y-%m-%d').date()
+            except ValueError:
+                continue
+            for entry in os.scandir(day_entry.path):
+                name, ext = os.path.splitext(entry.name)
+                if ext in DAILY_CANDLE_EXTENSIONS:
+                    self._files.setdefault(name, {})[day] = entry.path
+
+    @property
+    def names(self):
+        """
+        所有文件名（不含扩展名），如：BTC-USDT_5m
+        """
+        return sorted(self._files.keys())
+
+    def files(self, name):
+        """
+        指定文件名按日期排序的文件路径列表
+        """
+        files = self._files.get(name, {})
+        return [files[day] for day in sorted(files)]
+
+    def stored_days(self, symbol, interval):
+        """
+        已保存的日期列表，升序
+        """
+        return sorted(self._files.get(daily_candle_name(symbol, interval), {}).keys())
+
+    def missing_ranges(self, symbol, interval, begin_dt, end_dt):
+        """
+        计算需要抓取的时间段：没有保存的日期，以及最近保存的一天（可能不完整）
+        :return: [(开始时间, 结束时间)]，UTC时间，截取在begin_dt ~ end_dt之内
+        """
+        begin_day = begin_dt.astimezone(pytz.utc).date()
+        end_day = end_dt.astimezone(pytz.utc).date()
+        stored = self.stored_days(symbol, interval)
+        if stored:
+            # 最近保存的一天可能只抓取了部分数据，重新抓取
+            stored = stored[:-1]
+        stored = [day for day in stored if begin_day <= day <= end_day]
+
+        # 在首尾加入哨兵日期，相邻已保存日期之间间隔超过一天即为缺口
+        days = [begin_day - timedelta(days=1), *stored, end_day + timedelta(days=1)]
+        gaps = time_series_gaps(pd.Series(pd.to_datetime(days)), threshold=2 * 24 * 60)
+
+        ranges = []
+        for gap_begin, gap_end in zip(gaps['begin'], gaps['end']):
+            begin = pytz.utc.localize(gap_begin.to_pydatetime() + timedelta(days=1))
+            end = pytz.utc.localize(gap_end.to_pydatetime() - timedelta(seconds=1))
+            ranges.append((max(begin, begin_dt), min(end, end_dt)))
+        return ranges
+
+
+def daily_candle_name(symbol, interval):
+    """
+    按日保存的K线文件名（不含扩展名）
+    """
+    return f'{symbol.replace("/", "-")}_{interval}'
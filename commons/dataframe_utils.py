@@ -17,3 +17,16 @@ def filter_candle_dataframe_by_begin_end_offset_datetime(df, begin, end, offset,
         end = end_of_day(datetime.strptime(end, '%Y-%m-%d'), tz=tz)
         df = df[candle_date <= end.date()]
     return df
+
+
+def time_series_gaps(series, threshold):
+    """
+    找出时间序列中相邻两点间隔不小于threshold分钟的缺口
+    :return: 缺口的开始时间begin，结束时间end，及间隔gap_seconds, gap_minutes, gap_hours
+    """
+    df = pd.DataFrame({'begin': series.shift(1), 'end': series})
+    df.dropna(inplace=True)
+    df['gap_seconds'] = df['end'] - df['begin']
+    df['gap_minutes'] = df['gap_seconds'].dt.total_seconds() / 60
+    df['gap_hours'] = df['gap_minutes'] / 60
+    return df[df['gap_minutes'] >= threshold]
@@ -6,7 +6,7 @@ def dt_to_str(dt: datetime, *, with_timezone=False):
     """
     日期时间对象转字符串
     """
-    return dt.strftime('%Y-%m-%d %H:%M:%S' + ' %z' if with_timezone else '')
+    return dt.strftime('%Y-%m-%d %H:%M:%S' + (' %z' if with_timezone else ''))
 
 
 def ts_to_str(mills, tz):
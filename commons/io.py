@@ -1,6 +1,10 @@
 from pathlib import Path
+import numpy as np
 import pandas as pd
-from commons.constants import CANDLE_COLUMNS, CANDLE_DATETIME_COLUMN
+import pyarrow as pa
+import pyarrow.parquet as pq
+from commons.constants import CANDLE_COLUMNS, CANDLE_DATETIME_COLUMN, CANDLE_OPEN_COLUMN, CANDLE_HIGH_COLUMN, CANDLE_LOW_COLUMN, \
+    CANDLE_CLOSE_COLUMN, CANDLE_VOLUME_COLUMN
 
 DEFAULT_HDF_KEY = '/df'
 
@@ -31,16 +35,74 @@ def load_by_ext(path, **kwargs):
     raise RuntimeError(f'not supported: ', path)
 
 
-def load_candle_by_ext(path, **kwargs):
-    df = load_by_ext(path, **kwargs)
-    df = df[CANDLE_COLUMNS]
-    df.sort_values(CANDLE_DATETIME_COLUMN, inplace=True)
-    df.drop_duplicates(subset=[CANDLE_DATETIME_COLUMN], inplace=True)
+def iter_by_ext(path, chunksize, **kwargs):
+    """
+    分块读取文件，每块最多chunksize行，内存占用与chunksize成正比
+    h5文件需为table格式
+    """
+    if not isinstance(path, Path):
+        path = Path(path)
+    ext = extension(path)
+    if ext == 'csv':
+        with pd.read_csv(path, chunksize=chunksize, **kwargs) as reader:
+            yield from reader
+    elif ext == 'h5':
+        key = kwargs.pop('key', 'df')
+        with pd.HDFStore(path, mode='r') as store:
+            if not store.get_storer(key).is_table:
+                raise RuntimeError(f'chunked reading requires table format: {path}')
+            yield from store.select(key, chunksize=chunksize, **kwargs)
+    elif ext in ['par', 'parquet']:
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, **kwargs):
+            yield batch.to_pandas()
+    else:
+        raise RuntimeError(f'not supported: ', path)
+
+
+def load_candle_by_ext(path, *, compact=False, chunksize=250000, **kwargs):
+    """
+    载入K线数据，按时间排序并去重
+    :param compact: 紧凑模式，时间为datetime64[ms]，开高低收量为float32，内存约为默认的一半
+    :param chunksize: 紧凑模式下csv、parquet文件按块读取并转换的行数，不会载入完整的float64数据，h5文件整体载入后转换
+    """
+    if compact:
+        df = _load_compact_candle(path, chunksize, **kwargs)
+    else:
+        df = load_by_ext(path, **kwargs)
+        df = df[CANDLE_COLUMNS]
+        df = df.assign(**{CANDLE_DATETIME_COLUMN: pd.to_datetime(df[CANDLE_DATETIME_COLUMN])})
+
+    # 时间严格递增时已有序且无重复，无需排序
+    ts = df[CANDLE_DATETIME_COLUMN].values.view(np.int64)
+    if not (ts[1:] > ts[:-1]).all():
+        df.sort_values(CANDLE_DATETIME_COLUMN, inplace=True, kind='stable')
+        df.drop_duplicates(subset=[CANDLE_DATETIME_COLUMN], inplace=True)
     df.reset_index(inplace=True, drop=True)
-    df[CANDLE_DATETIME_COLUMN] = pd.to_datetime(df[CANDLE_DATETIME_COLUMN])
     return df
 
 
+def _load_compact_candle(path, chunksize, **kwargs):
+    path = Path(path)
+    ext = extension(path)
+    if ext == 'csv':
+        chunks = iter_by_ext(path, chunksize, **{'usecols': CANDLE_COLUMNS, **kwargs})
+    elif ext in ['par', 'parquet']:
+        chunks = iter_by_ext(path, chunksize, **{'columns': CANDLE_COLUMNS, **kwargs})
+    else:
+        chunks = [load_by_ext(path, **kwargs)]
+    compact = [_compact_candle(chunk) for chunk in chunks]
+    return pd.concat(compact, ignore_index=True) if compact else _compact_candle(pd.DataFrame(columns=CANDLE_COLUMNS))
+
+
+def _compact_candle(df):
+    dt = pd.to_datetime(df[CANDLE_DATETIME_COLUMN])
+    return pd.DataFrame({
+        CANDLE_DATETIME_COLUMN: dt.astype('datetime64[ms]' if dt.dt.tz is None else f'datetime64[ms, {dt.dt.tz}]'),
+        **{col: df[col].astype(np.float32) for col in [CANDLE_OPEN_COLUMN, CANDLE_HIGH_COLUMN, CANDLE_LOW_COLUMN, CANDLE_CLOSE_COLUMN,
+                                                       CANDLE_VOLUME_COLUMN]},
+    })
+
+
 def save_by_ext(path, df: pd.DataFrame, **kwargs):
     if isinstance(path, str):
         path = Path(path)
@@ -53,3 +115,47 @@ def save_by_ext(path, df: pd.DataFrame, **kwargs):
         df.to_hdf(path, **kwargs)
     elif ext in ['par', 'parquet']:
         df.to_parquet(path, **kwargs)
+
+
+class ChunkWriter:
+    """
+    分块写入文件，各块的默认索引按行号连续编号
+    h5文件以table格式写入
+    """
+
+    def __init__(self, path, **kwargs):
+        if isinstance(path, str):
+            path = Path(path)
+        self._path = path
+        self._ext = extension(path)
+        if self._ext not in ['csv', 'h5', 'par', 'parquet']:
+            raise RuntimeError(f'not supported: ', path)
+        self._kwargs = kwargs
+        self._rows = 0
+        self._writer = None
+
+    def write(self, df: pd.DataFrame):
+        if isinstance(df.index, pd.RangeIndex):
+            df = df.set_axis(pd.RangeIndex(self._rows, self._rows + len(df)))
+        if self._ext == 'csv':
+            df.to_csv(self._path, mode='a' if self._rows else 'w', header=self._rows == 0, **self._kwargs)
+        elif self._ext == 'h5':
+            kwargs = {'key': 'df', **self._kwargs}
+            df.to_hdf(self._path, mode='a' if self._rows else 'w', format='table', append=True, **kwargs)
+        else:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self._path, table.schema, **self._kwargs)
+            self._writer.write_table(table)
+        self._rows += len(df)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
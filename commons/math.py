@@ -11,7 +11,7 @@ def floor_to_precision(data, decimal_place=0):
 
 def number_exponent(num):
     if isinstance(num, (list, tuple)):
-        return [number_exponent(n) for n in number_exponent]
+        return [number_exponent(n) for n in num]
     elif not isinstance(num, str):
         return number_exponent(str(num))
     else:
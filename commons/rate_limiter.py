@@ -0,0 +1,36 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    异步令牌桶限流，每秒产生rate个令牌，最多积攒capacity个
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def from_exchange(exchange, capacity=1):
+        """
+        按ccxt交易所的rateLimit（两次请求的最小间隔毫秒数）构建
+        """
+        return TokenBucket(1000 / exchange.rateLimit, capacity)
+
+    async def acquire(self):
+        """
+        获取一个令牌，令牌不足时等待
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
@@ -8,16 +8,16 @@ class TimeInterval:
 
     def __init__(self, interval):
         self.s = interval.strip().lower()
-        self.unit = interval[-1]
-        self.num = int(interval[:-1])
+        self.unit = self.s[-1]
+        self.num = int(self.s[:-1])
 
-        if self.unit is 'm':
+        if self.unit == 'm':
             # 分钟
             self.delta = timedelta(minutes=self.num)
-        elif self.unit is 'h':
+        elif self.unit == 'h':
             # 小时
-            self.delta = timedelta(hours=self.unit)
-        elif self.unit is 'd':
+            self.delta = timedelta(hours=self.num)
+        elif self.unit == 'd':
             # 日
             self.delta = timedelta(days=self.num)
         else:
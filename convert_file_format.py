@@ -1,12 +1,21 @@
 import argparse
 from commons.argparse_commons import ParseKwargs
-from commons.io import load_by_ext, save_by_ext
+from commons.io import ChunkWriter, iter_by_ext, load_by_ext, save_by_ext
 
 
-def convert_format(input_path, output_path, in_params, out_params):
+def convert_format(input_path, output_path, in_params, out_params, chunksize=None):
+    """
+    :param chunksize: 每次读写的行数，不设置则整体载入
+    """
     in_params = in_params if in_params else {}
     out_params = out_params if out_params else {}
     print('read: ', input_path)
+    if chunksize:
+        print('write: ', output_path)
+        with ChunkWriter(output_path, **out_params) as writer:
+            for df in iter_by_ext(input_path, chunksize, **in_params):
+                writer.write(df)
+        return
     df = load_by_ext(input_path, **in_params)
     print('write: ', output_path)
     save_by_ext(output_path, df, **out_params)
@@ -18,6 +27,7 @@ if __name__ == '__main__':
     parser.add_argument('output', help='output file')
     parser.add_argument('--input-config', nargs='*', action=ParseKwargs)
     parser.add_argument('--output-config', nargs='*', action=ParseKwargs)
+    parser.add_argument('--chunksize', type=int, help='read and write in chunks of rows, for files larger than memory')
     args = parser.parse_args()
 
-    convert_format(args.input, args.output, args.input_config, args.output_config)
+    convert_format(args.input, args.output, args.input_config, args.output_config, args.chunksize)
@@ -1,13 +1,28 @@
 from datetime import timedelta
+import numpy as np
+import pandas as pd
+from numba import njit
+from pandas.tseries.frequencies import to_offset
+from pandas.tseries.offsets import Tick
 from commons.constants import CANDLE_COLUMNS, CANDLE_DATETIME_COLUMN, CANDLE_OPEN_COLUMN, CANDLE_CLOSE_COLUMN, CANDLE_HIGH_COLUMN, CANDLE_LOW_COLUMN, \
     CANDLE_VOLUME_COLUMN
+from pipeline.columns import pipeline_columns
 
 
-def resample_candle_time_window(df, period, drop_zero_volume=True, drop_zero_open=True):
+NANOS_PER_DAY = 24 * 60 * 60 * 10 ** 9
+
+
+def resample_candle_time_window(df, period, drop_zero_volume=True, drop_zero_open=True, origin='start_day'):
     """
     合成长时间K线
+    已排序、时长能整除一天的常规K线走快速路径，不经过pandas resample
     """
-    period_df = df.resample(rule=period, on=CANDLE_DATETIME_COLUMN, label='left', closed='left').agg(
+    arrays = _regular_candle_arrays(df)
+    nanos = _fixed_period_nanos(period, origin)
+    if arrays is not None and nanos is not None:
+        return _reduce_candles(arrays, nanos, drop_zero_volume, drop_zero_open)
+
+    period_df = df.resample(rule=period, on=CANDLE_DATETIME_COLUMN, label='left', closed='left', origin=origin).agg(
         {
             CANDLE_OPEN_COLUMN: 'first',
             CANDLE_HIGH_COLUMN: 'max',
@@ -16,18 +31,216 @@ def resample_candle_time_window(df, period, drop_zero_volume=True, drop_zero_ope
             CANDLE_VOLUME_COLUMN: 'sum',
         })
 
-    # 去除没有交易的K线
-    if drop_zero_open:
-        period_df.dropna(subset=[CANDLE_OPEN_COLUMN], inplace=True)
-    if drop_zero_volume:
-        period_df = period_df[period_df[CANDLE_VOLUME_COLUMN] > 0]
-
+    period_df = _drop_empty_candles(period_df, drop_zero_volume, drop_zero_open)
     period_df.reset_index(inplace=True)
     df = period_df[CANDLE_COLUMNS]
 
     return df
 
 
+def resample_candle_time_windows(df, periods, drop_zero_volume=True, drop_zero_open=True):
+    """
+    一次合成多个周期的K线，如：['5T', '15T', '1H', '4H']，返回{周期: K线}
+    快速路径下只提取一次原始数据，长周期由能整除它的已合成短周期再合成
+    """
+    arrays = _regular_candle_arrays(df)
+    nanos = {period: _fixed_period_nanos(period) for period in periods} if arrays is not None else {}
+    results = {period: resample_candle_time_window(df, period, drop_zero_volume, drop_zero_open) for period in periods if nanos.get(period) is None}
+
+    fixed_periods = sorted([period for period in periods if nanos.get(period) is not None], key=nanos.get)
+    source = _source_buckets(arrays) if fixed_periods else None
+    buckets = {}  # 周期纳秒数 -> 未去除空K线的分桶结果
+    for period in fixed_periods:
+        step = nanos[period]
+        finer = max((n for n in buckets if step % n == 0), default=None)
+        if step not in buckets:
+            buckets[step] = _reduce_buckets(buckets[finer] if finer else source, step)
+        results[period] = _candle_frame(buckets[step], arrays, step, drop_zero_volume, drop_zero_open)
+    return {period: results[period] for period in periods}
+
+
+def _fixed_period_nanos(period, origin='start_day'):
+    """
+    时长固定且能整除一天的周期返回纳秒数，此时按当日零点或按纪元对齐结果相同；否则返回None
+    """
+    try:
+        offset = to_offset(period)
+    except ValueError:
+        return None
+    if not isinstance(offset, Tick) or offset.nanos <= 0 or NANOS_PER_DAY % offset.nanos != 0:
+        return None
+    if not (isinstance(origin, str) and origin == 'start_day'):
+        # 指定的起点需与纪元对齐
+        try:
+            origin = pd.Timestamp(origin)
+        except (TypeError, ValueError):
+            return None
+        if origin.tzinfo is not None and str(origin.tzinfo) != 'UTC' or origin.value % offset.nanos != 0:
+            return None
+    return offset.nanos
+
+
+def _regular_candle_arrays(df):
+    """
+    快速路径的输入检查：时间为naive或UTC且严格递增，开高低收量为浮点数且没有NaN
+    满足条件返回(纳秒时间戳, 开, 高, 低, 收, 量, 时间列类型)，否则返回None
+    """
+    if df.empty:
+        return None
+    dt = df[CANDLE_DATETIME_COLUMN]
+    dtype = dt.dtype
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        if str(dtype.tz) != 'UTC':
+            return None
+    elif not np.issubdtype(dtype, np.datetime64):
+        return None
+    ts = dt.values.astype('datetime64[ns]').view(np.int64)
+    if not (ts[1:] > ts[:-1]).all():
+        return None
+
+    values = []
+    for col in [CANDLE_OPEN_COLUMN, CANDLE_HIGH_COLUMN, CANDLE_LOW_COLUMN, CANDLE_CLOSE_COLUMN, CANDLE_VOLUME_COLUMN]:
+        arr = df[col].to_numpy()
+        if not np.issubdtype(arr.dtype, np.floating) or np.isnan(arr).any():
+            return None
+        values.append(np.ascontiguousarray(arr))
+    return (ts, *values, dtype)
+
+
+def _reduce_candles(arrays, nanos, drop_zero_volume, drop_zero_open):
+    buckets = _reduce_buckets(_source_buckets(arrays), nanos)
+    return _candle_frame(buckets, arrays, nanos, drop_zero_volume, drop_zero_open)
+
+
+def _source_buckets(arrays):
+    """
+    原始数据视为每行一个桶：(开始时间, 在原始数据中的开始行, 开, 高, 低, 收)
+    """
+    ts, open_, high, low, close, _, _ = arrays
+    return ts, np.arange(len(ts)), open_, high, low, close
+
+
+def _reduce_buckets(buckets, nanos):
+    """
+    按周期合并桶：时间戳整除得到新桶的开始时间，有序数据中同一桶连续，用reduceat逐段归约
+    """
+    labels, rows, open_, high, low, close = buckets
+    labels = labels // nanos * nanos
+    starts = np.flatnonzero(np.concatenate(([True], labels[1:] != labels[:-1])))
+    ends = np.concatenate((starts[1:], [len(labels)])) - 1
+    return labels[starts], rows[starts], open_[starts], np.maximum.reduceat(high, starts), np.minimum.reduceat(low, starts), close[ends]
+
+
+def _candle_frame(buckets, arrays, nanos, drop_zero_volume, drop_zero_open):
+    labels, rows, open_, high, low, close = buckets
+    volume, dtype = arrays[5], arrays[6]
+    columns = {
+        CANDLE_OPEN_COLUMN: open_,
+        CANDLE_HIGH_COLUMN: high,
+        CANDLE_LOW_COLUMN: low,
+        CANDLE_CLOSE_COLUMN: close,
+        # 成交量总是由原始数据求和，与pandas结果一致
+        CANDLE_VOLUME_COLUMN: _segment_sum(volume, rows),
+    }
+
+    if not drop_zero_open and not drop_zero_volume:
+        # 保留没有交易的K线，与pandas resample一致，价格为NaN，成交量为0
+        full_labels = labels[0] + nanos * np.arange((labels[-1] - labels[0]) // nanos + 1, dtype=np.int64)
+        if len(full_labels) > len(labels):
+            pos = (labels - labels[0]) // nanos
+            for col, values in columns.items():
+                full = np.zeros(len(full_labels), dtype=values.dtype) if col == CANDLE_VOLUME_COLUMN else np.full(len(full_labels), np.nan, dtype=values.dtype)
+                full[pos] = values
+                columns[col] = full
+            labels = full_labels
+    elif drop_zero_volume:
+        keep = columns[CANDLE_VOLUME_COLUMN] > 0
+        labels = labels[keep]
+        columns = {col: values[keep] for col, values in columns.items()}
+
+    dt = pd.Series(labels.view('datetime64[ns]'))
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        dt = dt.dt.tz_localize(dtype.tz)
+    return pd.DataFrame({CANDLE_DATETIME_COLUMN: dt.astype(dtype), **columns})[CANDLE_COLUMNS]
+
+
+@njit(error_model='numpy')
+def _segment_sum(values, starts):
+    """
+    逐段求和，使用与pandas groupby sum相同的Kahan补偿求和，结果一致
+    """
+    n = len(values)
+    m = len(starts)
+    out = np.zeros(m, dtype=values.dtype)
+    for k in range(m):
+        end = starts[k + 1] if k + 1 < m else n
+        total = out[k]
+        compensation = out[k]
+        for i in range(starts[k], end):
+            y = values[i] - compensation
+            t = total + y
+            compensation = t - total - y
+            total = t
+        out[k] = total
+    return out
+
+
+class CandleResampler:
+    """
+    分块合成长时间K线，最后一根可能未完成的K线留到下一块数据中合成，结果与resample_candle_time_window相同
+    输入数据需按时间升序
+    """
+
+    def __init__(self, period, drop_zero_volume=True, drop_zero_open=True):
+        self.period = period
+        self.drop_zero_volume = drop_zero_volume
+        self.drop_zero_open = drop_zero_open
+        self._origin = None  # 与整体合成相同，以第一根K线当日零点为起点
+        self._pending = None  # 最后一根K线对应的原始数据
+
+    def update(self, df):
+        """
+        加入一块数据，返回已完成的K线
+        """
+        if df.empty:
+            return df[CANDLE_COLUMNS].iloc[0:0]
+        if self._pending is not None:
+            df = pd.concat([self._pending, df], ignore_index=True)
+        if self._origin is None:
+            self._origin = pd.Timestamp(df[CANDLE_DATETIME_COLUMN].iat[0]).normalize()
+
+        period_df = resample_candle_time_window(df, self.period, drop_zero_volume=False, drop_zero_open=False, origin=self._origin)
+        last_begin = period_df[CANDLE_DATETIME_COLUMN].iat[-1]
+        self._pending = df[df[CANDLE_DATETIME_COLUMN] >= last_begin]
+        return self._finish(period_df.iloc[:-1])
+
+    def flush(self):
+        """
+        返回最后一根K线
+        """
+        if self._pending is None:
+            return pd.DataFrame(columns=CANDLE_COLUMNS)
+        period_df = resample_candle_time_window(self._pending, self.period, drop_zero_volume=False, drop_zero_open=False, origin=self._origin)
+        self._pending = None
+        return self._finish(period_df)
+
+    def _finish(self, period_df):
+        period_df = _drop_empty_candles(period_df, self.drop_zero_volume, self.drop_zero_open)
+        return period_df.reset_index(drop=True)
+
+
+def _drop_empty_candles(period_df, drop_zero_volume, drop_zero_open):
+    """
+    去除没有交易的K线
+    """
+    if drop_zero_open:
+        period_df = period_df.dropna(subset=[CANDLE_OPEN_COLUMN])
+    if drop_zero_volume:
+        period_df = period_df[period_df[CANDLE_VOLUME_COLUMN] > 0]
+    return period_df
+
+
+@pipeline_columns(reads=[CANDLE_DATETIME_COLUMN])
 def skip_days(df, days):
     """
     忽略n天的k线
@@ -37,6 +250,7 @@ def skip_days(df, days):
     return df
 
 
+@pipeline_columns(reads=[CANDLE_OPEN_COLUMN, CANDLE_CLOSE_COLUMN], writes=lambda params: [params.get('col', 'next_open')])
 def add_next_open(df, col='next_open'):
     """
     找出下根K线的开盘价
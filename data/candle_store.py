@@ -0,0 +1,161 @@
+import os
+from fnmatch import fnmatch
+import uuid
+from datetime import datetime
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pytz
+from commons.constants import CANDLE_COLUMNS, CANDLE_DATETIME_COLUMN
+from commons.datetime_utils import begin_of_day, end_of_day
+
+# 分区字段
+PARTITION_COLUMNS = ['exchange', 'market', 'symbol', 'interval', 'year', 'month']
+# 时间列统一存储为UTC毫秒
+_DATETIME_TYPE = pa.timestamp('ms', tz='UTC')
+
+
+class CandleStore:
+    """
+    Hive分区的Parquet K线库，目录结构为：
+    <root>/exchange=<exchange>/market=<market>/symbol=<symbol>/interval=<interval>/year=<year>/month=<month>/part-<id>.parquet
+    """
+
+    def __init__(self, root):
+        self._root = Path(root)
+
+    def append(self, df, exchange, market, symbol, interval, *, row_group_size=100000):
+        """
+        追加K线数据，每个月份分区写入一个新文件，重复数据在合并或载入时去除
+        """
+        df = _normalize(df)
+        months = df[CANDLE_DATETIME_COLUMN].dt.year * 100 + df[CANDLE_DATETIME_COLUMN].dt.month
+        for month, group in df.groupby(months, sort=True):
+            folder = self._partition_path(exchange, market, symbol, interval, month // 100, month % 100)
+            folder.mkdir(parents=True, exist_ok=True)
+            table = pa.Table.from_pandas(group, preserve_index=False)
+            pq.write_table(table, folder / f'part-{uuid.uuid4().hex}.parquet', row_group_size=row_group_size)
+
+    def compact(self, exchange=None, market=None, symbol=None, interval=None, *, row_group_size=100000):
+        """
+        合并各月份分区内的文件，按时间排序并去重
+        """
+        filters = {'exchange': exchange, 'market': market, 'symbol': _symbol_name(symbol) if symbol else None, 'interval': interval}
+        for folder in self._month_partitions(filters):
+            files = sorted(folder.glob('*.parquet'))
+            if len(files) <= 1:
+                continue
+            df = pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
+            df = _normalize(df)
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            # 先写临时文件，成功后再删除旧文件
+            tmp = folder / f'.compact-{uuid.uuid4().hex}.tmp'
+            pq.write_table(table, tmp, row_group_size=row_group_size)
+            for f in files:
+                f.unlink()
+            tmp.rename(folder / f'part-{uuid.uuid4().hex}.parquet')
+
+    def load(self, symbol, interval, begin=None, end=None, columns=None, *, exchange=None, market=None, tz=pytz.utc):
+        """
+        载入K线数据，通过分区及行组统计信息过滤，只读取需要的数据
+        :param begin: 开始日期（含），'%Y-%m-%d'字符串或datetime
+        :param end: 结束日期（含），'%Y-%m-%d'字符串或datetime
+        :param columns: 需要的列，默认为全部K线列
+        """
+        begin = _to_datetime(begin, tz, end=False)
+        end = _to_datetime(end, tz, end=True)
+
+        cond = (ds.field('symbol') == _symbol_name(symbol)) & (ds.field('interval') == interval)
+        if exchange:
+            cond &= ds.field('exchange') == exchange
+        if market:
+            cond &= ds.field('market') == market
+        if begin:
+            begin = begin.astimezone(pytz.utc)
+            cond &= (ds.field('year') > begin.year) | ((ds.field('year') == begin.year) & (ds.field('month') >= begin.month))
+            cond &= ds.field(CANDLE_DATETIME_COLUMN) >= pa.scalar(begin, type=_DATETIME_TYPE)
+        if end:
+            end = end.astimezone(pytz.utc)
+            cond &= (ds.field('year') < end.year) | ((ds.field('year') == end.year) & (ds.field('month') <= end.month))
+            cond &= ds.field(CANDLE_DATETIME_COLUMN) <= pa.scalar(end, type=_DATETIME_TYPE)
+
+        columns = list(columns) if columns else CANDLE_COLUMNS
+        if CANDLE_DATETIME_COLUMN not in columns:
+            columns = [CANDLE_DATETIME_COLUMN, *columns]
+        if not self._root.exists():
+            return pd.DataFrame(columns=columns)
+        dataset = ds.dataset(self._root, format='parquet', partitioning='hive')
+        df = dataset.to_table(columns=columns, filter=cond).to_pandas()
+        df.sort_values(CANDLE_DATETIME_COLUMN, inplace=True)
+        df.drop_duplicates(subset=[CANDLE_DATETIME_COLUMN], keep='last', inplace=True)
+        df.reset_index(inplace=True, drop=True)
+        return df
+
+    def symbols(self, interval=None, pattern='*', *, exchange=None, market=None):
+        """
+        库中已有的交易对，pattern为通配符，如'*-USDT-SWAP'
+        """
+        if not self._root.exists():
+            return []
+        filters = {'exchange': exchange, 'market': market, 'interval': interval}
+        folders = self._partitions(filters, PARTITION_COLUMNS[:PARTITION_COLUMNS.index('interval') + 1])
+        names = {folder.parent.name.split('=', 1)[1] for folder in folders}
+        return sorted(name for name in names if fnmatch(name, _symbol_name(pattern)))
+
+    def _partition_path(self, exchange, market, symbol, interval, year, month):
+        return self._root / f'exchange={exchange}' / f'market={market}' / f'symbol={_symbol_name(symbol)}' / f'interval={interval}' / \
+            f'year={year}' / f'month={month}'
+
+    def _month_partitions(self, filters):
+        """
+        遍历符合条件的月份分区目录
+        """
+        return self._partitions(filters, PARTITION_COLUMNS)
+
+    def _partitions(self, filters, columns):
+        """
+        按分区字段逐级遍历符合条件的分区目录
+        """
+        folders = [self._root]
+        for col in columns:
+            value = filters.get(col)
+            next_folders = []
+            for folder in folders:
+                if value is not None:
+                    child = folder / f'{col}={value}'
+                    if child.is_dir():
+                        next_folders.append(child)
+                else:
+                    next_folders.extend(Path(entry.path) for entry in os.scandir(folder) if entry.is_dir() and entry.name.startswith(f'{col}='))
+            folders = next_folders
+        return folders
+
+
+def _symbol_name(symbol):
+    return symbol.replace('/', '-')
+
+
+def _normalize(df):
+    """
+    只保留K线列，时间统一为UTC毫秒，排序并去重
+    """
+    df = df[CANDLE_COLUMNS].copy()
+    dt = pd.to_datetime(df[CANDLE_DATETIME_COLUMN])
+    dt = dt.dt.tz_localize(pytz.utc) if dt.dt.tz is None else dt.dt.tz_convert(pytz.utc)
+    df[CANDLE_DATETIME_COLUMN] = dt.astype('datetime64[ms, UTC]')
+    df.sort_values(CANDLE_DATETIME_COLUMN, inplace=True)
+    df.drop_duplicates(subset=[CANDLE_DATETIME_COLUMN], keep='last', inplace=True)
+    df.reset_index(inplace=True, drop=True)
+    return df
+
+
+def _to_datetime(value, tz, *, end):
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = datetime.strptime(value, '%Y-%m-%d')
+        return end_of_day(value, tz) if end else begin_of_day(value, tz)
+    value = pd.Timestamp(value)
+    return (value.tz_localize(tz) if value.tzinfo is None else value).to_pydatetime()
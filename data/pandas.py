@@ -1,3 +1,16 @@
+from pipeline.columns import pipeline_columns
+
+
+def _with_dataframe_reads(params):
+    """
+    dropna指定subset时只读取subset中的列，其他方法（包括未指定subset的dropna）视为读取所有列，列裁剪模式不生效
+    """
+    if params.get('method') == 'dropna' and params.get('subset') is not None:
+        return list(params['subset'])
+    return None
+
+
+@pipeline_columns(reads=_with_dataframe_reads)
 def with_dataframe(df, method, **kwargs):
     """
     包装pandas的dataframe方法为pipeline形式
@@ -0,0 +1,125 @@
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+
+_ALIGNMENT = 64  # 每列起始地址按64字节对齐
+
+
+class SharedDataFrame:
+    """
+    将DataFrame的数值列一次性放入共享内存，子进程以只读、零拷贝的方式挂载
+    """
+
+    def __init__(self, shm, meta, owner):
+        self._shm = shm
+        self._meta = meta
+        self._owner = owner
+        self._arrays = {name: self._view(col) for name, col in meta['columns'].items()}
+        self._index = self._view(meta['index']) if 'offset' in meta['index'] else None
+
+    @staticmethod
+    def create(df):
+        """
+        复制DataFrame到新建的共享内存，由创建者负责释放
+        """
+        columns, offset = {}, 0
+        arrays = []
+        for name in df.columns:
+            values, col = _column_values(df[name])
+            col['offset'] = offset
+            columns[name] = col
+            arrays.append(values)
+            offset = _align(offset + values.nbytes)
+
+        index = {}
+        if isinstance(df.index, pd.RangeIndex):
+            index.update(start=df.index.start, stop=df.index.stop, step=df.index.step)
+        else:
+            values, index = _column_values(df.index.to_series())
+            index['offset'] = offset
+            arrays.append(values)
+            offset = _align(offset + values.nbytes)
+
+        shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        meta = {'name': shm.name, 'length': len(df), 'columns': columns, 'index': index}
+        shared = SharedDataFrame(shm, meta, owner=True)
+        targets = [*[shared._arrays[name] for name in columns], *([shared._index] if shared._index is not None else [])]
+        for target, values in zip(targets, arrays):
+            target.flags.writeable = True
+            target[:] = values
+            target.flags.writeable = False
+        return shared
+
+    @staticmethod
+    def attach(meta):
+        """
+        在子进程中按描述信息挂载共享内存
+        """
+        shm = shared_memory.SharedMemory(name=meta['name'])
+        return SharedDataFrame(shm, meta, owner=False)
+
+    @property
+    def meta(self):
+        """
+        共享内存描述信息，可廉价地序列化传给子进程
+        """
+        return self._meta
+
+    def to_dataframe(self):
+        """
+        构建引用共享内存的只读DataFrame，各列不发生复制
+        """
+        data = {name: _column_from_values(self._arrays[name], col) for name, col in self._meta['columns'].items()}
+        if self._index is None:
+            meta = self._meta['index']
+            index = pd.RangeIndex(meta['start'], meta['stop'], meta['step'])
+        else:
+            index = pd.Index(_column_from_values(self._index, self._meta['index']))
+        return pd.DataFrame(data, index=index, copy=False)
+
+    def close(self):
+        """
+        断开共享内存，创建者同时释放共享内存
+        """
+        self._arrays = {}
+        self._index = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+    def _view(self, col):
+        dtype = np.dtype(col['dtype'])
+        arr = np.ndarray((self._meta['length'],), dtype=dtype, buffer=self._shm.buf, offset=col['offset'])
+        arr.flags.writeable = False
+        return arr
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _align(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _column_values(series):
+    """
+    取出列的连续数组及其类型信息，带时区的时间列按UTC存储
+    """
+    col = {}
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        col['tz'] = str(series.dt.tz)
+    values = np.ascontiguousarray(series.values)
+    if values.dtype.hasobject:
+        raise RuntimeError(f'column not supported in shared memory: {series.name}, dtype: {series.dtype}')
+    col['dtype'] = values.dtype.str
+    return values, col
+
+
+def _column_from_values(values, col):
+    if 'tz' in col:
+        unit = np.datetime_data(values.dtype)[0]
+        return pd.arrays.DatetimeArray(values, dtype=pd.DatetimeTZDtype(unit=unit, tz=col['tz']))
+    return values
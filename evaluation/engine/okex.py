@@ -1,13 +1,21 @@
 import numpy as np
-from commons.constants import CANDLE_OPEN_COLUMN, CANDLE_CLOSE_COLUMN, POSITION_COLUMN, EQUITY_CHANGE_COLUMN, EQUITY_CURVE_COLUMN
+from commons.constants import CANDLE_DATETIME_COLUMN, CANDLE_OPEN_COLUMN, CANDLE_HIGH_COLUMN, CANDLE_LOW_COLUMN, CANDLE_CLOSE_COLUMN, POSITION_COLUMN, \
+    EQUITY_CHANGE_COLUMN, EQUITY_CURVE_COLUMN
 
 from data.candle import add_next_open
 from evaluation.equity_curve_commons import _group_trade, _contract_number, _future_margin, _fill_unchanged_columns, _net_value, _blow_up, _equity_change, \
     _equity_curve
 from evaluation.position import _open_close_position_condition
 from evaluation.slippage import price_with_slippage
+from pipeline.columns import pipeline_columns
 
+# 计算资金曲线读取及写入的列
+FUTURE_EQUITY_INPUT_COLUMNS = [CANDLE_DATETIME_COLUMN, CANDLE_OPEN_COLUMN, CANDLE_HIGH_COLUMN, CANDLE_LOW_COLUMN, CANDLE_CLOSE_COLUMN, POSITION_COLUMN]
+FUTURE_EQUITY_OUTPUT_COLUMNS = ['next_open', 'start_time', 'contract_num', 'open_pos_price', 'margin', 'net_value', 'blow_up', EQUITY_CHANGE_COLUMN,
+                                EQUITY_CURVE_COLUMN]
 
+
+@pipeline_columns(reads=FUTURE_EQUITY_INPUT_COLUMNS, writes=FUTURE_EQUITY_OUTPUT_COLUMNS)
 def future_equity_curve(df, cash=10000, face_value=0.01, min_trade_precision=0, leverage_rate=1, slippage_mode='ratio', slippage=0.001, commission=0.0002,
                         min_margin_ratio=0.01):
     """
@@ -0,0 +1,179 @@
+import numpy as np
+from numba import njit
+from commons.constants import CANDLE_DATETIME_COLUMN, CANDLE_OPEN_COLUMN, CANDLE_HIGH_COLUMN, CANDLE_LOW_COLUMN, CANDLE_CLOSE_COLUMN, POSITION_COLUMN, \
+    EQUITY_CHANGE_COLUMN, EQUITY_CURVE_COLUMN
+from evaluation.engine.okex import FUTURE_EQUITY_INPUT_COLUMNS, FUTURE_EQUITY_OUTPUT_COLUMNS
+from evaluation.metrics import annual_return
+from pipeline.columns import pipeline_columns
+
+# 滑点模式编码，其他模式视为无滑点
+_SLIPPAGE_MODES = {'fixed': 1, 'ratio': 2}
+# future_equity_objectives返回的优化目标
+FUTURE_EQUITY_OBJECTIVES = [EQUITY_CURVE_COLUMN, 'max_drawdown', 'trade_count', 'blow_up', 'cagr', 'cagr_max_drawdown', 'win_rate']
+
+
+@pipeline_columns(reads=FUTURE_EQUITY_INPUT_COLUMNS, writes=FUTURE_EQUITY_OUTPUT_COLUMNS)
+def future_equity_curve(df, cash=10000, face_value=0.01, min_trade_precision=0, leverage_rate=1, slippage_mode='ratio', slippage=0.001, commission=0.0002,
+                        min_margin_ratio=0.01):
+    """
+    计算OKEx合约交易资金曲线，numba编译版本，参数及输出列与evaluation.engine.okex一致
+    """
+    arrays = _candle_arrays(df)
+    curves, _ = _future_equity_curve(*arrays, float(cash), float(face_value), int(min_trade_precision), float(leverage_rate),
+                                     _SLIPPAGE_MODES.get(slippage_mode, 0), float(slippage), float(commission), float(min_margin_ratio), True)
+    next_open, start_idx, contract_num, open_pos_price, margin, net_value, blow_up, equity_change, equity_curve = curves
+
+    df['next_open'] = next_open
+    start_time = df[CANDLE_DATETIME_COLUMN].take(np.maximum(start_idx, 0)).set_axis(df.index)
+    df['start_time'] = start_time.where(start_idx >= 0)
+    df['contract_num'] = contract_num
+    df['open_pos_price'] = open_pos_price
+    df['margin'] = margin
+    df['net_value'] = net_value
+    df['blow_up'] = blow_up
+    df[EQUITY_CHANGE_COLUMN] = equity_change
+    df[EQUITY_CURVE_COLUMN] = equity_curve
+
+    return df
+
+
+@pipeline_columns(reads=[*FUTURE_EQUITY_INPUT_COLUMNS], writes=FUTURE_EQUITY_OBJECTIVES)
+def future_equity_objectives(df, cash=10000, face_value=0.01, min_trade_precision=0, leverage_rate=1, slippage_mode='ratio', slippage=0.001,
+                             commission=0.0002, min_margin_ratio=0.01):
+    """
+    只计算优化目标，参数与future_equity_curve一致，不生成逐K线的列，资金曲线归零（爆仓）后提前结束
+    :return: {equity_curve: 最终资金, max_drawdown: 最大回撤（负数）, trade_count: 交易次数（提前结束时为爆仓前的次数）, blow_up: 是否爆仓,
+              cagr: 年化收益, cagr_max_drawdown: 年化收益/最大回撤（亏损时为负值）, win_rate: 胜率}，任一目标均可直接作为优化器的column参数
+    """
+    arrays = _candle_arrays(df)
+    _, (equity, max_drawdown, trade_count, win_count) = _future_equity_curve(*arrays, float(cash), float(face_value), int(min_trade_precision),
+                                                                            float(leverage_rate), _SLIPPAGE_MODES.get(slippage_mode, 0), float(slippage),
+                                                                            float(commission), float(min_margin_ratio), False)
+    times = df[CANDLE_DATETIME_COLUMN]
+    cagr = annual_return(equity, times.iloc[0], times.iloc[-1]) if len(df) else np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {EQUITY_CURVE_COLUMN: equity, 'max_drawdown': max_drawdown, 'trade_count': trade_count, 'blow_up': equity == 0, 'cagr': cagr,
+                'cagr_max_drawdown': -np.float64(cagr) / max_drawdown, 'win_rate': win_count / trade_count if trade_count else np.nan}
+
+
+def _candle_arrays(df):
+    """
+    取出计算所需的连续float64数组
+    """
+    return tuple(np.ascontiguousarray(df[col].to_numpy(dtype=np.float64, na_value=np.nan)) for col in
+                 [CANDLE_OPEN_COLUMN, CANDLE_HIGH_COLUMN, CANDLE_LOW_COLUMN, CANDLE_CLOSE_COLUMN, POSITION_COLUMN])
+
+
+@njit(error_model='numpy')
+def _slippage_price(price, direction, slippage_mode, slippage):
+    """
+    计算滑点后的成交价格
+    """
+    if slippage_mode == 1:
+        return price + slippage
+    elif slippage_mode == 2:
+        return price * (1 + slippage * direction)
+    return price
+
+
+@njit(error_model='numpy')
+def _future_equity_curve(open_, high, low, close, pos, cash, face_value, min_trade_precision, leverage_rate, slippage_mode, slippage, commission,
+                         min_margin_ratio, curve):
+    """
+    单次遍历计算持仓、保证金、爆仓、账户净值及资金曲线
+    :param curve: 为False时不生成逐K线的数组，只统计最终资金、最大回撤及交易次数，资金归零后提前结束
+    :return: (逐K线数组, (最终资金, 最大回撤, 交易次数, 盈利交易次数))
+    """
+    n = open_.shape[0]
+    m = n if curve else 0
+    next_open = np.empty(m)
+    start_idx = np.full(m, -1, dtype=np.int64)
+    contract_num = np.full(m, np.nan)
+    open_pos_price = np.full(m, np.nan)
+    margin = np.full(m, np.nan)
+    net_value = np.full(m, np.nan)
+    blow_up = np.full(m, np.nan)
+    equity_change = np.zeros(m)
+    equity_curve = np.empty(m)
+
+    precision = 10.0 ** min_trade_precision
+    start, cn, opp, mg, blown = -1, np.nan, np.nan, np.nan, False
+    last_net_value = np.nan  # 向前填充的上一个账户净值
+    equity = 1.0
+    peak, max_drawdown, trade_count, win_count = -np.inf, 0.0, 0, 0
+    for i in range(n):
+        # 下根K线的开盘价，最后一根使用收盘价
+        nxt = open_[i + 1] if i < n - 1 else close[i]
+        p = pos[i]
+
+        if p != 0:
+            open_cond = i == 0 or p != pos[i - 1]
+            close_cond = i == n - 1 or p != pos[i + 1]
+
+            if open_cond:
+                # 开仓：买入合约数，滑点后开仓价格，扣减手续费后的保证金
+                start = i
+                cn = np.floor(cash * leverage_rate / (face_value * open_[i]) * precision) / precision
+                opp = _slippage_price(open_[i], p, slippage_mode, slippage)
+                mg = cash - opp * face_value * cn * commission
+                blown = False
+                trade_count += 1
+            elif slippage_mode == 0:
+                # 无滑点时开仓价格随当前开盘价变化，与原引擎保持一致
+                opp = open_[i]
+
+            if curve:
+                start_idx[i] = start
+                contract_num[i] = cn
+                open_pos_price[i] = opp
+                margin[i] = mg
+
+            # 账户净值，平仓时按下根K线开盘价及滑点计算，并扣除平仓手续费
+            if close_cond:
+                close_pos_price = _slippage_price(nxt, -p, slippage_mode, slippage)
+                nv = mg + face_value * cn * (close_pos_price - opp) * p - close_pos_price * face_value * cn * commission
+            else:
+                nv = mg + face_value * cn * (close[i] - opp) * p
+
+            # 爆仓：最低保证金率低于维持保证金率，或平仓时净值为负，之后本次交易净值均为0
+            price_min = low[i] if p == 1 else (high[i] if p == -1 else np.nan)
+            net_value_min = mg + face_value * cn * (price_min - opp) * p
+            if net_value_min / (face_value * cn * price_min) <= min_margin_ratio + commission:
+                blown = True
+            if close_cond and nv < 0:
+                blown = True
+            if blown:
+                if curve:
+                    blow_up[i] = 1
+                nv = 0.0
+            if curve:
+                net_value[i] = nv
+            # 每笔交易收益为平仓净值相对初始资金的变化
+            if close_cond and nv > cash:
+                win_count += 1
+
+            # 资金变化，开仓时相对初始资金计算
+            if open_cond:
+                change = nv / cash - 1
+            else:
+                change = nv / last_net_value - 1
+            last_net_value = nv
+        else:
+            # 空仓时净值不变
+            change = last_net_value / last_net_value - 1
+
+        if np.isnan(change):
+            change = 0.0
+        equity *= 1 + change
+        peak = max(peak, equity)
+        max_drawdown = min(max_drawdown, equity / peak - 1 if peak > 0 else -1.0)
+        if curve:
+            next_open[i] = nxt
+            equity_change[i] = change
+            equity_curve[i] = equity
+        elif equity == 0:
+            # 爆仓后资金为0，之后的资金曲线不再变化
+            break
+
+    return (next_open, start_idx, contract_num, open_pos_price, margin, net_value, blow_up, equity_change, equity_curve), \
+        (equity, max_drawdown, trade_count, win_count)
@@ -0,0 +1,197 @@
+import numpy as np
+import pandas as pd
+from numba import njit
+from commons.constants import CANDLE_DATETIME_COLUMN, POSITION_COLUMN, EQUITY_CHANGE_COLUMN, EQUITY_CURVE_COLUMN
+from pipeline.columns import pipeline_columns
+
+# 所有指标，数值均未格式化
+METRICS = ['cumulative_net_value', 'cagr', 'cagr_mean_drawdown', 'cagr_max_drawdown', 'correlation', 'max_drawdown', 'max_drawdown_begin',
+           'max_drawdown_end', 'trades', 'wins', 'losses', 'win_rate', 'mean_change', 'profit_loss_ratio', 'max_profit', 'max_loss', 'max_holding_time',
+           'min_holding_time', 'mean_holding_time', 'max_consecutive_profit', 'max_consecutive_loss']
+
+
+@pipeline_columns(reads=[CANDLE_DATETIME_COLUMN, POSITION_COLUMN, EQUITY_CHANGE_COLUMN, EQUITY_CURVE_COLUMN], writes=METRICS)
+def strategy_metrics(df):
+    """
+    由逐K线的持仓及资金曲线计算所有回测指标，不生成逐笔交易的DataFrame，不修改传入的数据
+    返回dict，任一数值指标均可直接作为优化器的column参数
+    """
+    times = df[CANDLE_DATETIME_COLUMN]
+    change, holding = _bar_trades(_nanos(times), df[POSITION_COLUMN].to_numpy(dtype=np.float64, na_value=np.nan),
+                                  df[EQUITY_CHANGE_COLUMN].to_numpy(dtype=np.float64, na_value=np.nan))
+    return {**equity_curve_metrics(times, df[EQUITY_CURVE_COLUMN]), **trade_metrics(change, holding)}
+
+
+def equity_curve_metrics(times, equity_curve):
+    """
+    资金曲线指标：累积净值、年化收益、最大回撤及起止时间、年化收益/回撤比、时间与净值的相关系数
+    :param times: K线时间序列
+    :param equity_curve: 资金曲线序列
+    """
+    nanos = _nanos(times)
+    equity = np.asarray(equity_curve, dtype=np.float64)
+    max_drawdown, end, start, mean_drawdown = _drawdown(equity)
+    cagr = annual_return(equity[-1] / equity[0], times.iloc[0], times.iloc[-1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 以首根K线为原点，减小时间数值的量级
+        x = (nanos - nanos[0]).astype(np.float64)
+        x -= x.mean()
+        y = equity - equity.mean()
+        correlation = (x @ y) / np.sqrt((x @ x) * (y @ y))
+        return {
+            'cumulative_net_value': equity[-1],
+            'cagr': cagr,
+            # 回撤为负数，取反后亏损时为负值，可直接作为最大化的优化目标
+            'cagr_mean_drawdown': -cagr / mean_drawdown,
+            'cagr_max_drawdown': -cagr / max_drawdown,
+            'correlation': correlation,
+            'max_drawdown': max_drawdown,
+            'max_drawdown_begin': times.iloc[start] if start >= 0 else pd.NaT,
+            'max_drawdown_end': times.iloc[end] if end >= 0 else pd.NaT,
+        }
+
+
+def annual_return(ratio, begin, end):
+    """
+    年化收益
+    :param ratio: 期末与期初资金之比
+    :param begin: 开始时间
+    :param end: 结束时间
+    """
+    years = np.float64((end - begin) / pd.Timedelta(days=365))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.float64(ratio) ** (1 / years) - 1
+
+
+def trade_metrics(change, holding):
+    """
+    逐笔交易指标：交易、盈利、亏损笔数，胜率，平均盈亏，盈亏比，单笔最大盈亏，持仓时间，最大连续盈亏笔数
+    :param change: 每笔交易收益
+    :param holding: 每笔交易持仓时间（纳秒），少一根K线的时长
+    """
+    change = np.asarray(change, dtype=np.float64)
+    holding = np.asarray(holding, dtype=np.int64)
+    trades = len(change)
+    profit, loss = change[change > 0], change[change < 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'trades': trades,
+            'wins': len(profit),
+            'losses': int(np.count_nonzero(change <= 0)),
+            'win_rate': len(profit) / trades if trades else np.nan,
+            'mean_change': np.nanmean(change) if trades else np.nan,
+            'profit_loss_ratio': -profit.mean() / loss.mean() if len(profit) and len(loss) else np.nan,
+            'max_profit': np.nanmax(change) if trades else np.nan,
+            'max_loss': np.nanmin(change) if trades else np.nan,
+            'max_holding_time': pd.Timedelta(holding.max()) if trades else pd.NaT,
+            'min_holding_time': pd.Timedelta(holding.min()) if trades else pd.NaT,
+            'mean_holding_time': pd.Timedelta(holding.mean()) if trades else pd.NaT,
+            'max_consecutive_profit': _max_run(change > 0),
+            'max_consecutive_loss': _max_run(change < 0),
+        }
+
+
+def format_metrics(metrics):
+    """
+    格式化为回测报告的单行DataFrame，年化收益/回撤比与原报告一致显示绝对值
+    """
+    values = {
+        'Cumulative Net Value': round(metrics['cumulative_net_value'], 2),
+        'CAGR': round(metrics['cagr'], 2),
+        'CAGR / Mean DD': round(abs(metrics['cagr_mean_drawdown']), 2),
+        'CAGR / Max DD': round(abs(metrics['cagr_max_drawdown']), 2),
+        'Correlation Coefficient': round(metrics['correlation'], 4),
+        'Maximum Drawdown': format(metrics['max_drawdown'], '.2%'),
+        'Maximum Drawdown Begin': str(metrics['max_drawdown_begin']),
+        'Maximum Drawdown End': str(metrics['max_drawdown_end']),
+        # 笔数与原报告一致输出为浮点数
+        'Number of Trades': float(metrics['trades']),
+        'Number of Win': float(metrics['wins']),
+        'Number of Loss': float(metrics['losses']),
+        'Win Rate': format(metrics['win_rate'], '.2%'),
+        'Average Profit & Loss Per Transaction': format(metrics['mean_change'], '.2%'),
+        'Profit & Loss Ratio': round(metrics['profit_loss_ratio'], 2),
+        'Maximum Single Profit': format(metrics['max_profit'], '.2%'),
+        'Maximum Single Loss': format(metrics['max_loss'], '.2%'),
+        'Maximum Single Holding Time': _format_timedelta(metrics['max_holding_time']),
+        'Minimum Single Holding Time': _format_timedelta(metrics['min_holding_time']),
+        'Avg. Holding Time': _format_timedelta(metrics['mean_holding_time']),
+        'Maximum Consecutive Profit': float(metrics['max_consecutive_profit']),
+        'Maximum Consecutive Loss': float(metrics['max_consecutive_loss']),
+    }
+    return pd.DataFrame({key: [value] for key, value in values.items()})
+
+
+def _format_timedelta(td):
+    if pd.isna(td):
+        return str(pd.NaT)
+    hours = td.seconds // 3600
+    minutes = (td.seconds - hours * 3600) // 60
+    return f'{td.days} days {hours} hours {minutes} minutes'
+
+
+def _nanos(times):
+    """
+    K线时间转换为纳秒整数，兼容毫秒精度及带时区的时间
+    """
+    return pd.DatetimeIndex(times).as_unit('ns').asi8
+
+
+@njit(error_model='numpy')
+def _drawdown(equity):
+    """
+    单次遍历计算回撤，忽略NaN
+    :return: (最大回撤, 最大回撤结束位置, 最大回撤开始位置（此前的最高点）, 平均回撤)
+    """
+    peak, peak_idx = np.nan, -1
+    max_drawdown, end, start = np.nan, -1, -1
+    total, count = 0.0, 0
+    for i in range(equity.shape[0]):
+        v = equity[i]
+        if np.isnan(v):
+            continue
+        if peak_idx < 0 or v > peak:
+            peak, peak_idx = v, i
+        dd = v / peak - 1
+        if np.isnan(dd):
+            continue
+        total += dd
+        count += 1
+        if end < 0 or dd < max_drawdown:
+            max_drawdown, end, start = dd, i, peak_idx
+    return max_drawdown, end, start, total / count if count else np.nan
+
+
+@njit
+def _max_run(mask):
+    """
+    最长的连续True个数
+    """
+    longest, run = 0, 0
+    for v in mask:
+        run = run + 1 if v else 0
+        longest = max(longest, run)
+    return longest
+
+
+@njit(error_model='numpy')
+def _bar_trades(nanos, position, equity_change):
+    """
+    由逐K线持仓划分交易，仓位非0且与上根K线不同时开仓，与transfer_equity_curve_to_trade一致
+    :return: (每笔交易收益, 每笔交易持仓时间)
+    """
+    n = position.shape[0]
+    change = np.empty(n)
+    holding = np.empty(n, dtype=np.int64)
+    k, start = -1, 0
+    for i in range(n):
+        p = position[i]
+        if p == 0 or np.isnan(p):
+            continue
+        if i == 0 or p != position[i - 1]:
+            k += 1
+            change[k] = 1.0
+            start = nanos[i]
+        change[k] *= 1 + equity_change[i]
+        holding[k] = nanos[i] - start
+    return change[:k + 1] - 1, holding[:k + 1]
@@ -0,0 +1,72 @@
+from functools import reduce
+from multiprocessing.pool import Pool
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from commons.constants import CANDLE_DATETIME_COLUMN, EQUITY_CURVE_COLUMN
+from pipeline.pipeline import Pipeline
+
+
+def portfolio_equity_curves(template, symbols, loader, *, scopes=None, context=None, workers=None):
+    """
+    多进程分别对每个品种运行策略管道，子进程各自载入K线，只返回资金曲线
+    :param symbols: 品种列表，作为loader的参数及结果的键，同时写入管道上下文的symbol
+    :param loader: 载入K线的函数loader(symbol)，需可被子进程序列化（模块级函数或partial）
+    :param context: 追加到管道上下文的配置，如timezone
+    :return: {品种: 以K线时间为索引的资金曲线}，顺序与symbols一致
+    """
+    curves = {}
+    with Pool(processes=workers) as pool:
+        tasks = [(symbol, template, loader, scopes, context) for symbol in symbols]
+        for symbol, curve in tqdm(pool.imap_unordered(_symbol_equity_curve, tasks), total=len(tasks)):
+            curves[symbol] = curve
+    return {symbol: curves[symbol] for symbol in symbols}
+
+
+def _symbol_equity_curve(task):
+    symbol, template, loader, scopes, context = task
+    pipeline = Pipeline.build_from_template(template)
+    pipeline.context.update(context or {})
+    pipeline.context['symbol'] = symbol
+    res = pipeline.process(loader(symbol), scopes=scopes)
+    # 回测报告返回结果dict
+    df = res.get(EQUITY_CURVE_COLUMN) if isinstance(res, dict) else res
+    if not isinstance(df, pd.DataFrame) or EQUITY_CURVE_COLUMN not in df.columns:
+        raise RuntimeError(f'pipeline result of {symbol} has no {EQUITY_CURVE_COLUMN} column')
+    return symbol, pd.Series(df[EQUITY_CURVE_COLUMN].to_numpy(), index=pd.DatetimeIndex(df[CANDLE_DATETIME_COLUMN]), name=symbol)
+
+
+def combine_equity_curves(curves, weights=None, *, rebalance=False):
+    """
+    按共同的时间索引对齐各品种资金曲线，按资金分配比例合成组合资金曲线
+    品种数据开始前资金闲置（净值为1），结束后保持最后的净值
+    :param curves: {品种: 以K线时间为索引的资金曲线}
+    :param weights: {品种: 资金分配比例}，自动归一化，默认等权
+    :param rebalance: 为True时每根K线按分配比例再平衡，否则各品种分配的资金独立运行
+    :return: DataFrame，K线时间、各品种资金曲线及组合资金曲线
+    """
+    if not curves:
+        raise RuntimeError('no equity curves to combine')
+    weights = weights or {symbol: 1 for symbol in curves}
+    missing = [symbol for symbol in curves if symbol not in weights]
+    if missing:
+        raise RuntimeError(f'no weights for symbols: {missing}')
+    w = np.array([float(weights[symbol]) for symbol in curves])
+    if w.sum() <= 0:
+        raise RuntimeError(f'invalid weights: {weights}')
+    w /= w.sum()
+
+    index = reduce(pd.Index.union, [curve.index for curve in curves.values()]).unique()
+    aligned = pd.DataFrame({symbol: curve[~curve.index.duplicated(keep='last')].reindex(index).ffill().fillna(1.0) for symbol, curve in curves.items()})
+    values = aligned.to_numpy()
+    if rebalance:
+        change = values[1:] / values[:-1] - 1
+        # 净值归零后不再变化
+        change = np.where(values[:-1] == 0, 0, change)
+        equity = np.concatenate([[w @ values[0]], w @ values[0] * np.cumprod(1 + change @ w)])
+    else:
+        equity = values @ w
+
+    aligned[EQUITY_CURVE_COLUMN] = equity
+    aligned.index.name = CANDLE_DATETIME_COLUMN
+    return aligned.reset_index()
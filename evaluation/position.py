@@ -1,8 +1,10 @@
 import numpy as np
 import pandas as pd
 from commons.constants import CANDLE_DATETIME_COLUMN, SIGNAL_COLUMN, POSITION_COLUMN
+from pipeline.columns import pipeline_columns
 
 
+@pipeline_columns(reads=[SIGNAL_COLUMN], writes=[POSITION_COLUMN])
 def position_from_signal(df):
     """
     通过信号计算持仓情况
@@ -14,6 +16,7 @@ def position_from_signal(df):
     return df
 
 
+@pipeline_columns(reads=[CANDLE_DATETIME_COLUMN, POSITION_COLUMN], writes=[POSITION_COLUMN])
 def disallow_transaction_daily(df, time):
     """
     针对每天特定时刻不允许交易的情况，调整持仓
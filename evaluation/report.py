@@ -1,52 +1,115 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import numpy as np
-import matplotlib.pyplot as plt
+import pandas as pd
+from matplotlib.figure import Figure
 from commons.constants import CANDLE_DATETIME_COLUMN, EQUITY_CURVE_COLUMN, CANDLE_CLOSE_COLUMN
-from evaluation.statistics import transfer_equity_curve_to_trade, strategy_evaluate, monthly_return
+from evaluation.metrics import strategy_metrics, format_metrics
+from evaluation.statistics import transfer_equity_curve_to_trade, monthly_return
 
 
-def draw_equity_curve(df, path):
+def draw_equity_curve(df, path, *, buckets=2000):
+    """
+    绘制资金曲线、线性拟合及收盘价，K线较多时按最大最小值抽样，每个桶保留最高、最低点，曲线形状与逐K线绘制一致
+    不使用pyplot的全局状态，可在多个线程中同时绘制
+    :param buckets: 抽样的桶数，约为图片宽度的像素数
+    """
     # 保存结果
     print(f'saving equity curve image to {path}')
-    ec_df = df[[EQUITY_CURVE_COLUMN, CANDLE_CLOSE_COLUMN]].copy()
-    ec_df.index = df[CANDLE_DATETIME_COLUMN]
+    times = pd.DatetimeIndex(df[CANDLE_DATETIME_COLUMN])
+    equity = df[EQUITY_CURVE_COLUMN].to_numpy(dtype=np.float64)
+    close = df[CANDLE_CLOSE_COLUMN].to_numpy(dtype=np.float64)
 
-    plt.figure(figsize=(20, 10))
-    ec_df[EQUITY_CURVE_COLUMN].plot(style='r', legend=True)
+    fig = Figure(figsize=(20, 10))
+    ax = fig.add_subplot()
+    idx = minmax_indices(equity, buckets)
+    ax.plot(times[idx], equity[idx], 'r', label=EQUITY_CURVE_COLUMN)
 
-    x = ec_df.index.values.astype(np.int64)
-    coef = np.polyfit(x=x, y=ec_df[EQUITY_CURVE_COLUMN], deg=1)
-    ec_df['EQUITY_CURVE_FIT'] = x * coef[0] + coef[1]
-    ec_df['EQUITY_CURVE_FIT'].plot(style='g')
+    # 拟合直线只需绘制两端
+    x = times.as_unit('ns').asi8
+    coef = np.polyfit(x=x, y=equity, deg=1)
+    ends = [0, len(x) - 1]
+    ax.plot(times[ends], x[ends] * coef[0] + coef[1], 'g')
 
-    ec_df[CANDLE_CLOSE_COLUMN].plot(secondary_y=True, style="b", legend=True)
-    plt.savefig(path)
+    ax_close = ax.twinx()
+    idx = minmax_indices(close, buckets)
+    ax_close.plot(times[idx], close[idx], 'b', label=f'{CANDLE_CLOSE_COLUMN} (right)')
+    lines = ax.get_lines()[:1] + ax_close.get_lines()
+    ax.legend(lines, [line.get_label() for line in lines], loc='upper left')
+    fig.savefig(path)
     return df
 
 
-def common_back_testing_report(df, path, *, equity_curve_data=True, equity_curve_chart=True, trade_data=True, evaluation_data=True, monthly_return_data=True):
+def minmax_indices(values, buckets):
+    """
+    最大最小值抽样：均分为buckets个桶，每个桶保留最小、最大值的位置，返回升序的位置
+    """
+    n = len(values)
+    if n <= 2 * buckets:
+        return np.arange(n)
+    size = -(-n // buckets)
+    padded = np.full(-(-n // size) * size, np.nan)
+    padded[:n] = values
+    padded = padded.reshape(-1, size)
+    nan = np.isnan(padded)
+    offsets = np.arange(padded.shape[0]) * size
+    # 全为NaN的桶取第一个位置，绘图时断开
+    imin = np.where(nan, np.inf, padded).argmin(axis=1) + offsets
+    imax = np.where(nan, -np.inf, padded).argmax(axis=1) + offsets
+    idx = np.unique(np.concatenate([imin, imax, [0, n - 1]]))
+    return idx[idx < n]
+
+
+def common_back_testing_report(df, path, *, equity_curve_data=True, equity_curve_chart=True, trade_data=True, evaluation_data=True, monthly_return_data=True,
+                               workers=None):
+    """
+    回测报告，各项输出相互独立，只计算需要的输出，在线程池中同时执行，不修改传入的数据
+    :param workers: 线程数，默认由ThreadPoolExecutor决定
+    :return: {equity_curve: 传入的数据, 以及已计算的trades, monthly_return, evaluation_result}
+    """
     path = Path(path)
+    # 组合回测时每个品种的报告保存在各自的子目录
+    symbol = getattr(common_back_testing_report, 'pipeline_context', {}).get('symbol')
+    if symbol:
+        path = path / symbol
     path.mkdir(parents=True, exist_ok=True)
 
-    if equity_curve_data:
-        df.to_parquet(path / 'equity_curve.parquet')
+    tasks = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if equity_curve_data:
+            tasks['equity_curve_data'] = executor.submit(df.to_parquet, path / 'equity_curve.parquet')
+        if equity_curve_chart:
+            tasks['equity_curve_chart'] = executor.submit(draw_equity_curve, df, path / 'equity_curve.png')
+        if trade_data:
+            tasks['trades'] = executor.submit(_trade_report, df, path / 'trade.csv')
+        if evaluation_data:
+            tasks['evaluation_result'] = executor.submit(_evaluation_report, df, path / 'evaluation_result.csv')
+        if monthly_return_data:
+            tasks['monthly_return'] = executor.submit(_monthly_return_report, df, path / 'monthly_return.csv')
+
+    # 取出结果，任务中的异常在此抛出
+    results = {key: task.result() for key, task in tasks.items()}
+    results.pop('equity_curve_data', None)
+    results.pop('equity_curve_chart', None)
+    return {'equity_curve': df, **results}
 
-    if equity_curve_chart:
-        draw_equity_curve(df, path / 'equity_curve.png')
 
+def _trade_report(df, path):
     trades = transfer_equity_curve_to_trade(df)
-    if trade_data:
-        trades.to_csv(path / 'trade.csv')
+    trades.to_csv(path)
+    return trades
 
-    ev = strategy_evaluate((df, trades))
-    ev = ev.T
+
+def _evaluation_report(df, path):
+    # 由逐K线的持仓直接统计，与strategy_evaluate结果一致，无需等待逐笔交易
+    ev = format_metrics(strategy_metrics(df)).T
     ev.index.name = 'name'
     ev.columns = ['value']
-    if evaluation_data:
-        ev.T.to_csv(path / 'evaluation_result.csv')
+    ev.T.to_csv(path)
+    return ev
 
-    monthly_rtn = monthly_return(df)
-    if monthly_return_data:
-        monthly_rtn.to_csv(path / 'monthly_return.csv')
 
-    return {'equity_curve': df, 'trades': trades, 'monthly_return': monthly_rtn, 'evaluation_result': ev}
+def _monthly_return_report(df, path):
+    monthly_rtn = monthly_return(df)
+    monthly_rtn.to_csv(path)
+    return monthly_rtn
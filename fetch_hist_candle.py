@@ -1,17 +1,22 @@
 import argparse
+import asyncio
+import json
 import time
 from pathlib import Path
 import pandas as pd
 from tqdm import tqdm
 import ccxt
+import ccxt.async_support as ccxt_async
+from commons.rate_limiter import TokenBucket
 from commons.time_interval import TimeInterval
 from commons.datetime_utils import dt_to_str, ts_to_str, dt_to_mills, str_to_timezone
 from commons.argparse_commons import parse_period_arguments
-from commons.daily_candle_csv_writer import DailyCandleCSVWriter
+from commons.daily_candle_csv_writer import DailyCandleWriter
+from commons.daily_candle_manifest import DailyCandleManifest
 
 
 def fetch_hist_ohlc(exchange, symbols, intervals, begin_dt, end_dt, output_folder, *, market='spot', npr=1000,
-                    sleep=0.1, tz):
+                    sleep=0.1, tz, exchange_name=None, incremental=False, fmt='csv'):
     """
     使用ccxt抓取并保存指定交易所、多组交易对、指定时间段的K线历史数据
     :param exchange: ccxt交易所
@@ -24,30 +29,27 @@ def fetch_hist_ohlc(exchange, symbols, intervals, begin_dt, end_dt, output_folde
     :param npr: 每次请求的返回的最大数据条数，不能大于交易所限制
     :param sleep: 两次请求之间的休息时间（秒），防止请求过于频繁而被阻止
     :param tz: 时区
+    :param exchange_name: 保存路径中的交易所名称，默认为ccxt交易所id
+    :param incremental: 增量抓取，只抓取没有保存的日期及最近保存的一天
+    :param fmt: 保存格式，csv或parquet
     """
     # 按交易所保存
-    output_folder = output_folder / args.exchange / market
-    mills_per_second = 1000  # 1秒 = 1000毫秒
-    end_ts = dt_to_mills(end_dt)  # 终止时间毫秒
+    output_folder = output_folder / (exchange_name or exchange.id) / market
+    manifest = DailyCandleManifest(output_folder) if incremental else None
     total_steps = len(intervals) * len(symbols)
     current_step = 0
     error_list = []
     for interval in intervals:
         # 计算抓取切片的开始时间
         interval = TimeInterval(interval)
-        delta_millis = mills_per_second * interval.delta.total_seconds()  # 每一根K线的毫秒数
-        step = int(delta_millis * npr)  # 两次请求开始时间间隔（毫秒）
-        begin_ts_points = range(dt_to_mills(begin_dt), end_ts, step)  # 每一次请求的开始时间（毫秒）列表
 
         for sym in symbols:
             current_step += 1
             print(f'[{current_step} / {total_steps}] fetch {sym} {interval.s} candle data ...')
-            writer = DailyCandleCSVWriter(output_folder, sym, interval.s, tz)
-            pbar = tqdm(begin_ts_points, desc=dt_to_str(begin_dt))
-            for begin_ts in pbar:
-                # 计算当次抓取记录数
-                end = min(end_ts, begin_ts + step - mills_per_second)
-                limit = int((end + mills_per_second - begin_ts) / delta_millis)
+            slices = _symbol_slices(manifest, sym, interval, begin_dt, end_dt, npr)
+            writer = DailyCandleWriter(output_folder, sym, interval.s, fmt=fmt)
+            pbar = tqdm(slices, desc=dt_to_str(begin_dt))
+            for begin_ts, end, limit in pbar:
                 # 更新状态条
                 period_str = f'{ts_to_str(begin_ts, tz)} - {ts_to_str(end, tz)}'
                 pbar.set_description(period_str)
@@ -60,12 +62,160 @@ def fetch_hist_ohlc(exchange, symbols, intervals, begin_dt, end_dt, output_folde
                     error_list.append('_'.join([sym, interval.s, period_str]))
                 # 歇一会
                 time.sleep(sleep)
-            # 将缓存数据写入磁盘
+            # 将剩余的缓存数据写入磁盘
             writer.save()
     if error_list:
         print(f'Errors: {error_list}')
 
 
+async def fetch_hist_ohlc_async(exchange, symbols, intervals, begin_dt, end_dt, output_folder, *, market='spot', npr=1000, concurrency=4,
+                                burst=1, retries=3, backoff=1.0, retry_on=(ccxt.NetworkError,), progress_file=None, tz, exchange_name=None,
+                                incremental=False, fmt='csv'):
+    """
+    使用ccxt.async_support并发抓取K线历史数据，参数及保存路径同fetch_hist_ohlc
+    :param exchange: ccxt.async_support交易所，或实现了异步fetch_ohlcv及rateLimit属性的对象
+    :param concurrency: 同时抓取的交易对、K线时长组合数量
+    :param burst: 令牌桶容量，允许短时间内连续发出的请求数，请求速率不超过交易所的rateLimit
+    :param retries: 网络错误的重试次数
+    :param backoff: 重试等待的初始秒数，每次重试翻倍
+    :param retry_on: 需要重试的异常类型，默认为ccxt的网络错误（含限流）
+                     其他错误（如交易对不存在、认证失败）不重试，立即结束该组合
+    :param progress_file: 进度文件，记录每个交易对、K线时长组合已写入磁盘的时间，重新运行时从该时间继续抓取
+    """
+    output_folder = output_folder / (exchange_name or exchange.id) / market
+    manifest = DailyCandleManifest(output_folder) if incremental else None
+    bucket = TokenBucket.from_exchange(exchange, burst)
+    semaphore = asyncio.Semaphore(concurrency)
+    progress_file = Path(progress_file) if progress_file else None
+    progress = _load_progress(progress_file)
+    loop = asyncio.get_running_loop()
+    error_list = []
+
+    async def fetch_with_retry(sym, interval, begin_ts, limit):
+        for attempt in range(retries + 1):
+            await bucket.acquire()
+            try:
+                return await exchange.fetch_ohlcv(symbol=sym, timeframe=interval.s, since=begin_ts, limit=limit)
+            except retry_on as e:
+                if attempt == retries:
+                    raise
+                print(f'{sym} {interval.s} {ts_to_str(begin_ts, tz)}: {e}, retry in {backoff * 2 ** attempt:.1f}s')
+                await asyncio.sleep(backoff * 2 ** attempt)
+
+    def update_progress(key, value):
+        progress[key] = value
+        _save_progress(progress_file, progress)
+
+    async def fetch_symbol(key, sym, interval, slices, pbar):
+        async with semaphore:
+            # 同一组合内按时间顺序抓取，不同组合之间并发，写入磁盘在线程池中执行，不阻塞其他组合的请求
+            writer = DailyCandleWriter(output_folder, sym, interval.s, fmt=fmt)
+            failed = False
+            for i, (begin_ts, end, limit) in enumerate(slices):
+                try:
+                    await loop.run_in_executor(None, writer.append, await fetch_with_retry(sym, interval, begin_ts, limit))
+                except Exception as e:
+                    # 之后的K线不再抓取，进度停留在已写入磁盘的时间，重新运行时从此处继续
+                    print(f'{sym} {interval.s}: {e}')
+                    error_list.append('_'.join([sym, interval.s, f'{ts_to_str(begin_ts, tz)} - {ts_to_str(end, tz)}']))
+                    pbar.update(len(slices) - i)
+                    failed = True
+                    break
+                pbar.update()
+                # 尚未写入磁盘的当日数据，重新运行时从当日开始重新抓取
+                pending = writer.pending_since
+                update_progress(key, pending if pending is not None else end + 1000)
+            # 出错时也写入已抓取的数据
+            await loop.run_in_executor(None, writer.save)
+            if not failed:
+                update_progress(key, True)
+
+    jobs = []
+    for interval in intervals:
+        interval = TimeInterval(interval)
+        for sym in symbols:
+            key = _progress_key(sym, interval.s, begin_dt, end_dt)
+            if progress.get(key) is True:
+                continue
+            slices = _symbol_slices(manifest, sym, interval, begin_dt, end_dt, npr)
+            if key in progress:
+                slices = _resume_slices(slices, progress[key], interval)
+            jobs.append((key, sym, interval, slices))
+
+    print(f'{len(jobs)} jobs to fetch, {len(symbols) * len(intervals) - len(jobs)} done before')
+    with tqdm(total=sum(len(slices) for *_, slices in jobs)) as pbar:
+        await asyncio.gather(*[fetch_symbol(key, sym, interval, slices, pbar) for key, sym, interval, slices in jobs])
+    if error_list:
+        print(f'Errors: {error_list}')
+
+
+def _request_slices(interval, begin_dt, end_dt, npr):
+    """
+    计算每次请求的开始时间、终止时间（毫秒）及请求条数
+    """
+    mills_per_second = 1000  # 1秒 = 1000毫秒
+    end_ts = dt_to_mills(end_dt)  # 终止时间毫秒
+    delta_millis = mills_per_second * interval.delta.total_seconds()  # 每一根K线的毫秒数
+    step = int(delta_millis * npr)  # 两次请求开始时间间隔（毫秒）
+    slices = []
+    for begin_ts in range(dt_to_mills(begin_dt), end_ts, step):
+        # 计算当次抓取记录数
+        end = min(end_ts, begin_ts + step - mills_per_second)
+        limit = int((end + mills_per_second - begin_ts) / delta_millis)
+        slices.append((begin_ts, end, limit))
+    return slices
+
+
+def _symbol_slices(manifest, sym, interval, begin_dt, end_dt, npr):
+    """
+    计算交易对的请求切片，增量模式下只抓取缺失的时间段
+    """
+    if manifest is None:
+        return _request_slices(interval, begin_dt, end_dt, npr)
+    ranges = manifest.missing_ranges(sym, interval.s, begin_dt, end_dt)
+    return [item for begin, end in ranges for item in _request_slices(interval, begin, end, npr)]
+
+
+def _resume_slices(slices, since, interval):
+    """
+    从since（毫秒）继续抓取，跳过之前的切片，并截短跨越since的切片
+    """
+    delta_millis = 1000 * interval.delta.total_seconds()
+    resumed = []
+    for begin_ts, end, limit in slices:
+        if end < since:
+            continue
+        if begin_ts < since:
+            begin_ts = since
+            limit = int((end + 1000 - begin_ts) / delta_millis)
+        resumed.append((begin_ts, end, limit))
+    return resumed
+
+
+def _progress_key(symbol, interval, begin_dt, end_dt):
+    return '|'.join([symbol, interval, str(dt_to_mills(begin_dt)), str(dt_to_mills(end_dt))])
+
+
+def _load_progress(path):
+    """
+    进度：{组合: 已完成为true，否则为继续抓取的开始时间（毫秒）}
+    """
+    if path and path.exists():
+        with open(path, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def _save_progress(path, progress):
+    if not path:
+        return
+    # 先写临时文件再替换，避免中断时进度文件损坏
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(progress, f, indent=2, sort_keys=True)
+    tmp.replace(path)
+
+
 def get_matched_symbols(exchange, symbols):
     """
     在交易所的所有交易对中进行匹配
@@ -98,6 +248,14 @@ if __name__ == '__main__':
     parser.add_argument('--items-per-request', type=int, default=1000, help='candle items per request, default: 1000')
     parser.add_argument('--sleep', type=float, default=1, help='seconds to sleep between requests, default: 1')
     parser.add_argument('--match-symbols', action='store_true', help='extract symbols by matching market symbols')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='fetch concurrently with rate limit of the exchange')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent symbol/interval jobs in async mode, default: 4')
+    parser.add_argument('--retries', type=int, default=3, help='retry times of network errors in async mode, default: 3')
+    parser.add_argument('--backoff', type=float, default=1.0, help='initial seconds to wait before retry, doubled on each retry, default: 1')
+    parser.add_argument('--burst', type=int, default=1, help='requests allowed in a burst within the exchange rate limit in async mode, default: 1')
+    parser.add_argument('--progress-file', help='progress file to resume async fetching')
+    parser.add_argument('--format', default='csv', choices=['csv', 'parquet'], help='daily file format, default: csv')
+    parser.add_argument('--incremental', action='store_true', help='only fetch days not saved yet and the latest saved day')
     args = parser.parse_args()
 
     # 交易所
@@ -125,4 +283,18 @@ if __name__ == '__main__':
     print(f'output folder: {output_folder}')
 
     # 开始抓取
-    fetch_hist_ohlc(exchange, symbols, candle_intervals, begin, end, output_folder, market=args.market, npr=args.items_per_request, sleep=args.sleep, tz=tz)
+    if args.use_async:
+        async def main():
+            async_exchange = getattr(ccxt_async, exchange_name)()
+            try:
+                await fetch_hist_ohlc_async(async_exchange, symbols, candle_intervals, begin, end, output_folder, market=args.market,
+                                            npr=args.items_per_request, concurrency=args.concurrency, burst=args.burst, retries=args.retries,
+                                            backoff=args.backoff, progress_file=args.progress_file, tz=tz, exchange_name=exchange_name,
+                                            incremental=args.incremental, fmt=args.format)
+            finally:
+                await async_exchange.close()
+
+        asyncio.run(main())
+    else:
+        fetch_hist_ohlc(exchange, symbols, candle_intervals, begin, end, output_folder, market=args.market, npr=args.items_per_request, sleep=args.sleep,
+                        tz=tz, exchange_name=exchange_name, incremental=args.incremental, fmt=args.format)
@@ -1,6 +1,7 @@
 import argparse
 from commons.io import load_candle_by_ext
 from commons.constants import CANDLE_DATETIME_COLUMN
+from commons.dataframe_utils import time_series_gaps
 from commons.datetime_utils import timezone_offset_delta, str_to_timezone
 
 
@@ -11,16 +12,7 @@ def find_time_series_gaps(file, column, threshold, timezone):
     print(f'output timezone: {timezone.zone}')
 
     df = load_candle_by_ext(file)
-    df = df[[column]]
-    df['begin'] = df[column].shift(1)
-    df.rename(columns={column: 'end'}, inplace=True)
-    df.dropna(inplace=True)
-    df = df[['begin', 'end']]
-    df['gap_seconds'] = df['end'] - df['begin']
-    df['gap_minutes'] = df['gap_seconds'].dt.total_seconds() / 60
-    df['gap_hours'] = df['gap_minutes'] / 60
-
-    gaps = df[df['gap_minutes'] >= threshold]
+    gaps = time_series_gaps(df[column], threshold)
     gaps = gaps.sort_values('gap_minutes', ascending=False, ignore_index=True)
     gaps['begin'] += timezone_offset_delta(timezone)
     gaps['end'] += timezone_offset_delta(timezone)
@@ -0,0 +1,101 @@
+import hashlib
+import weakref
+from collections import OrderedDict
+import numpy as np
+
+
+class IndicatorCache:
+    """
+    指标计算结果的LRU缓存，按(数据指纹, 方法, 参数)索引，限制条目数及总字节数
+    """
+
+    def __init__(self, maxsize=0, max_bytes=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._nbytes = 0
+        # 只读数据的指纹，按底层数组及视图位置索引
+        self._fingerprints = {}
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0
+
+    def fingerprint(self, series):
+        """
+        计算数据指纹，内容相同的数据指纹相同
+        只读数据（如共享内存中的K线）内容不会改变，每份数据只计算一次，之后按底层数组直接取出
+        """
+        values = np.asarray(series)
+        root = values
+        while isinstance(root.base, np.ndarray):
+            root = root.base
+        if root.flags.writeable:
+            return _digest(values)
+
+        key = (id(root), values.__array_interface__['data'][0], values.dtype.str, values.shape, values.strides)
+        memo = self._fingerprints.get(key)
+        # 底层数组已释放时id可能被复用，以弱引用确认是同一数组
+        if memo is None or memo[0]() is not root:
+            self._fingerprints = {k: v for k, v in self._fingerprints.items() if v[0]() is not None}
+            memo = self._fingerprints[key] = (weakref.ref(root), _digest(values))
+        return memo[1]
+
+    def get_or_compute(self, key, func):
+        """
+        命中则返回缓存结果，否则计算并缓存，结果为只读数组
+        """
+        if not self.enabled:
+            return func()
+        if key in self._items:
+            self.hits += 1
+            self._items.move_to_end(key)
+            return self._items[key]
+
+        self.misses += 1
+        value = np.asarray(func())
+        value.flags.writeable = False
+        self._items[key] = value
+        self._nbytes += value.nbytes
+        self._evict()
+        return value
+
+    def clear(self):
+        self._items.clear()
+        self._nbytes = 0
+        self._fingerprints.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def _evict(self):
+        while len(self._items) > self.maxsize or (self.max_bytes and self._nbytes > self.max_bytes and len(self._items) > 1):
+            _, value = self._items.popitem(last=False)
+            self._nbytes -= value.nbytes
+
+
+def _digest(values):
+    values = np.ascontiguousarray(values)
+    digest = hashlib.blake2b(values.view(np.uint8), digest_size=16).hexdigest()
+    return f'{values.dtype.str}:{values.shape[0]}:{digest}'
+
+
+# 进程内共享的指标缓存，默认不启用
+_cache = IndicatorCache()
+
+
+def indicator_cache():
+    """
+    获取进程内的指标缓存
+    """
+    return _cache
+
+
+def configure_indicator_cache(maxsize, max_bytes=None):
+    """
+    设置进程内的指标缓存，maxsize为0时不缓存
+    """
+    global _cache
+    _cache = IndicatorCache(maxsize, max_bytes)
+    return _cache
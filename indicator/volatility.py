@@ -1,15 +1,203 @@
+import math
+import numpy as np
+import pandas as pd
 from commons.constants import CANDLE_CLOSE_COLUMN
+from indicator.cache import indicator_cache
 from indicator.overlap import ma
+from pipeline.columns import pipeline_columns
 
 
+@pipeline_columns(reads=lambda params: [params.get('col', CANDLE_CLOSE_COLUMN)], writes=['BBM', 'BBU', 'BBL', 'BBB'])
 def bbands(df, col=CANDLE_CLOSE_COLUMN, period=200, width=2, ma_method='sma'):
-    """布林带指标"""
+    """布林带指标，均线和标准差只与周期有关，启用指标缓存时在不同带宽间复用"""
     period = int(period)
     width = float(width)
     series = df[col]
-    df['BBM'] = ma(ma_method, series, period)
-    std = series.rolling(period, min_periods=1).std(ddof=0)
-    df['BBU'] = df['BBM'] + std * width
-    df['BBL'] = df['BBM'] - std * width
+    cache = indicator_cache()
+    fingerprint = cache.fingerprint(series) if cache.enabled else None
+    bbm = cache.get_or_compute((fingerprint, 'ma', ma_method, period), lambda: _rolling_mean(series, period, ma_method))
+    std = cache.get_or_compute((fingerprint, 'rolling_std', period), lambda: _rolling_std(series, period))
+    df['BBM'] = bbm
+    df['BBU'] = bbm + std * width
+    df['BBL'] = bbm - std * width
     df['BBB'] = 100 * (df['BBM'] - df['BBL']) / df['BBM']
     return df
+
+
+class BollingerBands:
+    """
+    增量计算的布林带指标，每根K线O(1)更新，结果与bbands一致
+    与bbands相同，收盘价为NaN时视为缺失，只用窗口内其余的收盘价计算，窗口内全部缺失时结果为NaN；收盘价为inf时报错
+    """
+
+    def __init__(self, period=200, width=2, ma_method='sma'):
+        if ma_method.lower() != 'sma':
+            raise RuntimeError('ma method not supported: ', ma_method)
+        self.period = int(period)
+        self.width = float(width)
+        self.ma_method = ma_method
+        self._window = [0.0] * self.period  # 环形缓冲区，保存最近period个收盘价
+        self._pos = 0  # 下一个写入位置
+        self._filled = 0  # 缓冲区已写入的数量
+        self._count = 0  # 窗口内非NaN收盘价的数量
+        self._mean = 0.0
+        self._m2 = 0.0  # 离差平方和
+
+    def update(self, close):
+        """
+        加入一根K线的收盘价，返回(BBM, BBU, BBL, BBB)
+        """
+        close = float(close)
+        if math.isinf(close):
+            raise RuntimeError('close must be finite or NaN: ', close)
+        old = math.nan
+        if self._filled < self.period:
+            self._filled += 1
+        else:
+            old = self._window[self._pos]
+        if not math.isnan(close) and not math.isnan(old):
+            # 窗口已满，以新收盘价替换最早的收盘价
+            mean = self._mean + (close - old) / self._count
+            self._m2 += (close - old) * (close - mean + old - self._mean)
+            self._mean = mean
+        elif not math.isnan(old):
+            self._remove(old)
+        elif not math.isnan(close):
+            self._add(close)
+        self._window[self._pos] = close
+        self._pos = (self._pos + 1) % self.period
+        if self._pos == 0 and self._filled == self.period:
+            # 每个周期按窗口重算一次，消除累积误差，均摊后仍为O(1)
+            self._recompute()
+        return self.value
+
+    @property
+    def value(self):
+        """
+        当前的(BBM, BBU, BBL, BBB)
+        """
+        if self._count == 0:
+            return math.nan, math.nan, math.nan, math.nan
+        std = math.sqrt(max(self._m2, 0.0) / self._count)
+        bbm = self._mean
+        bbu = bbm + std * self.width
+        bbl = bbm - std * self.width
+        return bbm, bbu, bbl, 100 * (bbm - bbl) / bbm
+
+    def state(self):
+        """
+        导出检查点，可序列化为json
+        """
+        return {'period': self.period, 'width': self.width, 'ma_method': self.ma_method, 'window': self._ordered_window()}
+
+    @staticmethod
+    def from_state(state):
+        """
+        从检查点恢复，无需重放历史数据
+        """
+        bb = BollingerBands(state['period'], state['width'], state['ma_method'])
+        window = [float(v) for v in state['window'][-bb.period:]]
+        bb._window[:len(window)] = window
+        bb._filled = len(window)
+        bb._pos = bb._filled % bb.period
+        bb._recompute()
+        return bb
+
+    def _add(self, close):
+        # Welford算法累加
+        self._count += 1
+        delta = close - self._mean
+        self._mean += delta / self._count
+        self._m2 += delta * (close - self._mean)
+
+    def _remove(self, close):
+        # Welford算法的逆运算
+        if self._count == 1:
+            self._count, self._mean, self._m2 = 0, 0.0, 0.0
+            return
+        mean = (self._mean * self._count - close) / (self._count - 1)
+        self._m2 -= (close - self._mean) * (close - mean)
+        self._mean = mean
+        self._count -= 1
+        if self._count == 1:
+            # 只剩一个收盘价时离差为0，消除相减的残差
+            self._m2 = 0.0
+
+    def _ordered_window(self):
+        if self._filled < self.period:
+            return self._window[:self._filled]
+        return self._window[self._pos:] + self._window[:self._pos]
+
+    def _recompute(self):
+        values = [v for v in self._ordered_window() if not math.isnan(v)]
+        self._count = len(values)
+        self._mean = math.fsum(values) / len(values) if values else 0.0
+        self._m2 = math.fsum((v - self._mean) ** 2 for v in values)
+
+
+def bbands_grid(close, periods, widths, ma_method='sma'):
+    """
+    批量计算多组周期、带宽的布林带，每个周期的均线、标准差与bbands使用相同的滚动计算及指标缓存，结果与bbands完全一致
+    上下轨占用内存为 时间 * 周期数 * 带宽数 * 8字节，数据量大时使用bbands_grid_chunks分批计算
+    :param close: 收盘价序列
+    :param periods: 周期列表
+    :param widths: 带宽列表
+    :return: (BBM, BBU, BBL, BBB)，BBM形状为(时间, 周期)，其余为(时间, 周期, 带宽)
+    """
+    bbm, std = _grid_moments(close, periods, ma_method)
+    return _grid_bands(bbm, std, widths)
+
+
+def bbands_grid_chunks(close, periods, widths, ma_method='sma', max_bytes=2 ** 30):
+    """
+    分批计算bbands_grid，每批结果占用的内存不超过max_bytes（至少一个周期、一个带宽）
+    一个周期的结果超过max_bytes时按带宽再分批，同一周期的均线、标准差只计算一次
+    :return: (本批周期, 本批带宽, 本批bbands_grid结果)的迭代器
+    """
+    periods = np.asarray(periods)
+    widths = np.asarray(widths, dtype=np.float64)
+    width_size = int(max(1, min(len(widths), (max_bytes // (len(close) * 8) - 1) // 3)))
+    period_size = int(max(1, max_bytes // (len(close) * (1 + 3 * width_size) * 8))) if width_size == len(widths) else 1
+    for i in range(0, len(periods), period_size):
+        bbm, std = _grid_moments(close, periods[i:i + period_size], ma_method)
+        for j in range(0, len(widths), width_size):
+            yield periods[i:i + period_size], widths[j:j + width_size], _grid_bands(bbm, std, widths[j:j + width_size])
+
+
+def _grid_moments(close, periods, ma_method):
+    """
+    各周期的均线及标准差，形状为(时间, 周期)，与bbands共用指标缓存
+    """
+    series = close if isinstance(close, pd.Series) else pd.Series(np.asarray(close, dtype=np.float64))
+    periods = np.asarray(periods, dtype=np.float64).astype(np.int64)
+    cache = indicator_cache()
+    fingerprint = cache.fingerprint(series) if cache.enabled else None
+    # 按(周期, 时间)存放，每个周期的序列在内存中连续
+    bbm = np.empty((len(periods), len(series)))
+    std = np.empty((len(periods), len(series)))
+    for k, period in enumerate(periods):
+        period = int(period)
+        bbm[k] = cache.get_or_compute((fingerprint, 'ma', ma_method, period), lambda: _rolling_mean(series, period, ma_method))
+        std[k] = cache.get_or_compute((fingerprint, 'rolling_std', period), lambda: _rolling_std(series, period))
+    return bbm.T, std.T
+
+
+def _grid_bands(bbm, std, widths):
+    """
+    按(周期, 带宽, 时间)存放后转置为(时间, 周期, 带宽)，每组参数的序列在内存中连续，按列取出时无需按步长复制
+    """
+    widths = np.asarray(widths, dtype=np.float64)
+    bbm_t = bbm.T[:, None, :]
+    band = std.T[:, None, :] * widths[None, :, None]
+    bbu = bbm_t + band
+    bbl = bbm_t - band
+    bbb = 100 * (bbm_t - bbl) / bbm_t
+    return bbm, bbu.transpose(2, 0, 1), bbl.transpose(2, 0, 1), bbb.transpose(2, 0, 1)
+
+
+def _rolling_mean(series, period, ma_method):
+    return ma(ma_method, series, period).to_numpy()
+
+
+def _rolling_std(series, period):
+    return series.rolling(period, min_periods=1).std(ddof=0).to_numpy()
@@ -1,31 +1,103 @@
 import argparse
+from multiprocessing.pool import Pool
 from pathlib import Path
-import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
 from tqdm import tqdm
 from commons.constants import CANDLE_COLUMNS, CANDLE_DATETIME_COLUMN
+from commons.daily_candle_manifest import DailyCandleManifest
+from data.candle_store import CandleStore
 
+# 输出文件中的K线列类型，时间为UTC毫秒
+_SCHEMA = pa.schema([(CANDLE_DATETIME_COLUMN, pa.timestamp('ms')), *[(col, pa.float64()) for col in CANDLE_COLUMNS[1:]]])
 
-def merge_daily_csv_files(root_path, names):
+
+def merge_daily_csv_files(root_path, names, store=None, *, workers=None, memory_limit=256):
+    """
+    合并按日保存的K线CSV文件，保存为单个parquet文件，或追加到K线库
+    只扫描一次目录，使用进程池并行解析文件，按日期顺序边读边写
+    追加到K线库时按月份缓存，每个月份分区写入一个文件，最后合并分区内已有的文件
+    :param store: K线库路径，交易所及市场取自root_path的最后两级目录，如：../data/binance/spot/
+    :param workers: 解析文件的进程数，默认为CPU核数
+    :param memory_limit: 每个行组（及写入前缓存）的最大内存（MB）
+    """
     root_path = Path(root_path)
+    if store:
+        store = CandleStore(store)
+        exchange, market = root_path.resolve().parts[-2:]
+    manifest = DailyCandleManifest(root_path)
+    limit = memory_limit * 1024 * 1024
+
+    with Pool(workers) as pool:
+        pbar = tqdm(names)
+        for fn in pbar:
+            pbar.set_description(fn)
+            files = manifest.files(fn)
+            if not files:
+                continue
+
+            tmp_file = root_path / f'.{fn}.parquet.tmp'
+            if store:
+                symbol, interval = fn.rsplit('_', 1)
+                writer = None
+                write = lambda table: store.append(table.to_pandas(), exchange, market, symbol, interval)
+            else:
+                writer = pq.ParquetWriter(tmp_file, _SCHEMA)
+                # 每次写入一个行组
+                write = lambda table: writer.write_table(table, row_group_size=table.num_rows)
+
+            tables, nbytes = [], 0
+            first, last, month = None, None, None
+            # 目录按日期排序，每日文件内已按时间排序，按顺序写入即为有序
+            for table in pool.imap(_read_daily_file, files, chunksize=16):
+                if table.num_rows == 0:
+                    continue
+                dt = table.column(CANDLE_DATETIME_COLUMN)
+                first = dt[0].as_py() if first is None else first
+                last = dt[-1].as_py()
+                if store:
+                    # 每日文件属于同一月份，月份变化时之前的月份已完整，写入对应的分区
+                    if tables and (last.year, last.month) != month:
+                        write(pa.concat_tables(tables))
+                        tables, nbytes = [], 0
+                    month = (last.year, last.month)
+                tables.append(table)
+                nbytes += table.nbytes
+                if nbytes >= limit:
+                    write(pa.concat_tables(tables))
+                    tables, nbytes = [], 0
+            if tables:
+                write(pa.concat_tables(tables))
+            if store:
+                # 月份超过内存限制或分区中已有数据时，分区内有多个文件
+                store.compact(exchange, market, symbol, interval)
+
+            if writer:
+                writer.close()
+                if first is None:
+                    tmp_file.unlink()
+                    continue
+                # 写入完成后再按起止日期命名
+                output_file = f'{fn}_{first.strftime("%Y%m%d")}_{last.strftime("%Y%m%d")}.parquet'
+                tmp_file.replace(root_path / output_file)
+
 
-    pbar = tqdm(names)
-    for fn in pbar:
-        pbar.set_description(fn)
-        dfs = []
-        for child in root_path.glob('*'):
-            f = child / (fn + '.csv')
-            if f.exists():
-                df = pd.read_csv(f, parse_dates=[CANDLE_DATETIME_COLUMN])
-                dfs.append(df)
-        if dfs:
-            df = pd.concat(dfs, ignore_index=True)
-            df = df[CANDLE_COLUMNS]
-            df.sort_values(CANDLE_DATETIME_COLUMN, ignore_index=True, inplace=True)
-            begin = df[CANDLE_DATETIME_COLUMN].iat[0].strftime('%Y%m%d')
-            end = df[CANDLE_DATETIME_COLUMN].iat[-1].strftime('%Y%m%d')
-            output_file = f'{fn}_{begin}_{end}.parquet'
-            df[CANDLE_DATETIME_COLUMN] = df[CANDLE_DATETIME_COLUMN].astype("datetime64[ms]")
-            df.to_parquet(root_path / output_file)
+def _read_daily_file(path):
+    """
+    读取每日K线文件，转换为统一的列及类型
+    """
+    if path.endswith('.parquet'):
+        table = pq.read_table(path)
+    else:
+        table = pv.read_csv(path, read_options=pv.ReadOptions(use_threads=False))
+    table = table.select(CANDLE_COLUMNS)
+    dt = table.column(CANDLE_DATETIME_COLUMN)
+    if pa.types.is_timestamp(dt.type) and dt.type.tz is not None:
+        # 带时区的时间转为UTC时间
+        dt = dt.cast(pa.timestamp(dt.type.unit, tz='UTC')).cast(pa.timestamp(dt.type.unit))
+        table = table.set_column(0, CANDLE_DATETIME_COLUMN, dt)
+    return table.cast(_SCHEMA)
 
 
 if __name__ == '__main__':
@@ -33,9 +105,12 @@ if __name__ == '__main__':
     parser.add_argument('-r', '--root', default='../data/binance/spot/', help='root path, default: ../data/binance/spot/')
     parser.add_argument('-n', '--names', nargs="+", default=['BTC-USDT_5m', 'ETH-USDT_5m', 'LTC-USDT_5m', 'EOS-USDT_5m'],
                         help='file names, default: BTC-USDT_5m ETH-USDT_5m LTC-USDT_5m EOS-USDT_5m')
+    parser.add_argument('-s', '--store', help='append to partitioned parquet candle store instead of writing single parquet files')
+    parser.add_argument('-w', '--workers', type=int, help='worker processes to parse files, default: cpu count')
+    parser.add_argument('-m', '--memory-limit', type=int, default=256, help='max memory of each row group in MB, default: 256')
     args = parser.parse_args()
 
     print('root: ', args.root)
     print('names: ', ', '.join(args.names))
 
-    merge_daily_csv_files(args.root, args.names)
+    merge_daily_csv_files(args.root, args.names, args.store, workers=args.workers, memory_limit=args.memory_limit)
@@ -1,17 +1,79 @@
+import json
 from functools import partial
+from multiprocessing import cpu_count
+import numpy as np
 import pandas as pd
+from commons.math import number_exponent
+from data.shared_memory import SharedDataFrame
 from optim.variant_parameters import VariantParameters
-from optim.optimizer import optimize_func, multiprocessing_optimize
+from optim.optimizer import optimize_func, optimize_bbands_grid_func, bbands_grid_tasks, multiprocessing_optimize, init_worker
+from optim.result_store import OptimizeResultStore, optimize_run_key, variables_key
+from pipeline.pipeline import Pipeline
+from pipeline.profiler import active_profiler
 
 
-def optimize(df, target_template, variables, column, target='maximize', result_precision=0.01):
+def optimize(df, target_template, variables, column, target='maximize', result_precision=0.01, shared_memory=False, indicator_cache_size=16,
+             checkpoint=None, metrics=None, bbands_grid=True, bbands_grid_max_bytes=2 ** 28):
     """
     枚举搜索最优参数
+    :param metrics: 同时记录的其他指标（管道结果dict的键或结果列），每个指标一列，一次优化即可按任意指标排序或求帕累托前沿
+    :param shared_memory: 将K线数据放入共享内存，子进程只读挂载，避免每组参数都序列化、复制数据
+    :param indicator_cache_size: 子进程内指标缓存的条目数，0为不缓存
+    :param checkpoint: 结果保存的SQLite文件路径，结果到达即写入，中断后以相同的数据、模板及参数重新运行时跳过已完成的参数组合
+    :param bbands_grid: 只优化bbands的周期及带宽、管道为bbands→boll_trend（如ex302）时，每个周期用bbands_grid_chunks、boll_trend_grid
+        一次计算所有带宽的布林带及信号，其余方法仍逐组参数运行，结果不变
+    :param bbands_grid_max_bytes: 子进程内每批布林带结果的内存上限
     """
     parameters = VariantParameters.from_template_file(target_template, variables)
     context = parameters.extended_context(optimize.pipeline_context)
-    opt_fun = partial(optimize_func, context=context, parameters=parameters, df=df, column=column)
-    result = multiprocessing_optimize(opt_fun, parameters, total=parameters.total, result_precision=result_precision)
-    res_df = pd.DataFrame(result, columns=[*parameters.parameter_names, column])
+    if checkpoint:
+        run_key = optimize_run_key(df, parameters, context, column, metrics)
+        with OptimizeResultStore(checkpoint, run_key, parameters.parameter_names, column, metrics) as store:
+            done = store.done()
+            combinations = [c for c in parameters.parameter_product if variables_key(c) not in done]
+            result = _optimize(df, parameters, context, column, metrics, result_precision, shared_memory, indicator_cache_size, bbands_grid,
+                               bbands_grid_max_bytes, combinations, store)
+        result_exponent = number_exponent(result_precision)
+        result += [[*parameters.auto_round(json.loads(v)), *np.round(np.atleast_1d(r), result_exponent)] for v, r in done.items()]
+    else:
+        result = _optimize(df, parameters, context, column, metrics, result_precision, shared_memory, indicator_cache_size, bbands_grid,
+                           bbands_grid_max_bytes)
+    res_df = pd.DataFrame(result, columns=[*parameters.parameter_names, column, *(metrics or [])])
     res_df.sort_values(column, ascending=(target == 'minimize'), ignore_index=True, inplace=True)
     return res_df
+
+
+def _optimize(df, parameters, context, column, metrics, result_precision, shared_memory, indicator_cache_size, bbands_grid, bbands_grid_max_bytes,
+              combinations=None, store=None):
+    """
+    多进程计算参数组合，combinations为空时计算全部参数组合
+    """
+    total = parameters.total if combinations is None else len(combinations)
+    combinations = parameters.parameter_product if combinations is None else combinations
+    tasks = bbands_grid_tasks(parameters, Pipeline.build(parameters.actions, context), combinations) if bbands_grid else None
+    if tasks is not None:
+        # 每个任务为周期相同的一批参数组合
+        func, combinations, chunksize = partial(optimize_bbands_grid_func, max_bytes=bbands_grid_max_bytes), tasks, 1
+    else:
+        func, chunksize = optimize_func, _chunksize(parameters) if indicator_cache_size > 0 else 1
+    # 外层管道在记录性能时，子进程同样记录并合并
+    profiler = active_profiler()
+    profile_memory = profiler.trace_memory if profiler else None
+    if shared_memory:
+        with SharedDataFrame.create(df) as shared:
+            opt_fun = partial(func, context=context, parameters=parameters, df=None, column=column, metrics=metrics)
+            return multiprocessing_optimize(opt_fun, parameters, total=total, result_precision=result_precision, initializer=init_worker,
+                                            initargs=(shared.meta, indicator_cache_size, profile_memory), chunksize=chunksize, profiler=profiler,
+                                            combinations=combinations, store=store, batched=tasks is not None)
+    opt_fun = partial(func, context=context, parameters=parameters, df=df, column=column, metrics=metrics)
+    return multiprocessing_optimize(opt_fun, parameters, total=total, result_precision=result_precision, initializer=init_worker,
+                                    initargs=(None, indicator_cache_size, profile_memory), chunksize=chunksize, profiler=profiler,
+                                    combinations=combinations, store=store, batched=tasks is not None)
+
+
+def _chunksize(parameters):
+    """
+    第一个变量相同的参数组合尽量分配到同一子进程，同时保证每个子进程分到多批任务
+    """
+    first_count = parameters.variable_counts[0] if parameters.variable_counts else 1
+    return max(1, min(parameters.total // first_count, parameters.total // (cpu_count() * 4)))
@@ -1,35 +1,299 @@
+import importlib
+from functools import partial
 from multiprocessing.pool import Pool
 import numpy as np
+import pandas as pd
 from tqdm import tqdm
+from commons.constants import CANDLE_CLOSE_COLUMN, CANDLE_DATETIME_COLUMN, EQUITY_CURVE_COLUMN
+from pipeline.columns import pipeline_columns
 from pipeline.pipeline import Pipeline
 from commons.math import number_exponent
+from data.shared_memory import SharedDataFrame
+from indicator.cache import configure_indicator_cache
+from indicator.volatility import bbands_grid_chunks
+from pipeline.profiler import PipelineProfiler
+from signals.bollinger import boll_trend, boll_trend_grid
 
+# 子进程挂载的共享K线数据
+_shared_data = None
+# 子进程是否记录管道性能，None为不记录，否则为是否记录分配内存
+_profile_memory = None
+# 子进程内已解析的管道，按优化参数指纹索引
+_pipelines = {}
 
-def optimize_func(variables, context, parameters, df, column):
+BBANDS_METHOD = 'indicator.volatility.bbands'
+BOLL_TREND_METHOD = 'signals.bollinger.boll_trend'
+
+
+def init_worker(shared_meta=None, indicator_cache_size=0, profile_memory=None):
+    """
+    进程池初始化，子进程挂载共享内存中的K线数据，设置指标缓存
+    :param profile_memory: 不为None时记录每次优化的管道性能，随结果返回
+    """
+    global _shared_data, _profile_memory
+    if shared_meta:
+        _shared_data = SharedDataFrame.attach(shared_meta)
+    configure_indicator_cache(indicator_cache_size)
+    _profile_memory = profile_memory
+
+
+def optimize_func(variables, context, parameters, df, column, window=None, metrics=None):
     """
-    单次参数优化
+    单次参数优化，df为None时使用共享内存中的K线数据
+    记录性能时返回(参数, 结果, 性能记录)
+    :param window: 只使用最近的window根K线
+    :param metrics: 同时记录的其他指标，结果为[column, *metrics]的数组
     """
-    template = parameters.generate_template(variables)
-    pipeline = Pipeline.build(template, context)
-    df = df.copy()
-    df = pipeline.process(df, scopes=['optimize'])
-    result = df.iloc[-1][column]
+    pipeline = _compiled_pipeline(parameters, context).bind(parameters.bind_params(variables))
+    scopes = ['optimize']
+    # 列裁剪模式，只保留结果列，中间列在不再需要时删除
+    keep = [column, *metrics] if metrics else [column]
+    # 共享内存中的列为只读视图，管道只会新增列，无需复制
+    owned = df is None
+    df = _shared_data.to_dataframe() if df is None else df
+    if window:
+        df = df.iloc[-window:]
+        owned = False
+    if not owned and pipeline.required_columns(scopes, keep) is None:
+        df = df.copy()
+    # 否则管道只取需要的列组成新的DataFrame，不会修改传入的数据
+    if _profile_memory is not None:
+        profiler = PipelineProfiler(trace_memory=_profile_memory)
+        res = pipeline.process(df, scopes=scopes, profiler=profiler, keep=keep)
+        return variables, _result_values(res, column, metrics), profiler.records
+    res = pipeline.process(df, scopes=scopes, keep=keep)
+    result = _result_values(res, column, metrics)
     return variables, result
 
 
-def multiprocessing_optimize(func, parameters, total, result_precision=0.01):
+def bbands_grid_tasks(parameters, pipeline, combinations):
+    """
+    优化参数只有bbands的周期及带宽、且管道可批量计算布林带及信号（见bbands_grid_indices）时，将参数组合按周期分组，否则返回None
+    :return: [[周期相同的参数组合]]
+    """
+    if sorted(parameters.parameter_names) != ['period', 'width'] or set(parameters.variable_methods) != {BBANDS_METHOD}:
+        return None
+    if bbands_grid_indices(pipeline, ['optimize']) is None:
+        return None
+    period_index = parameters.parameter_names.index('period')
+    groups = {}
+    for variables in combinations:
+        groups.setdefault(variables[period_index], []).append(variables)
+    return list(groups.values())
+
+
+def bbands_grid_indices(pipeline, scopes):
+    """
+    范围内第一个方法为bbands、之后为boll_trend，且两者之间只有删除行的dropna时，返回两者在管道中的序号，否则返回None
+    """
+    indices = pipeline.scoped_indices(scopes)
+    names = [pipeline.actions[i].pipeline_name for i in indices]
+    if not names or names[0] != BBANDS_METHOD or BOLL_TREND_METHOD not in names:
+        return None
+    trend = names.index(BOLL_TREND_METHOD)
+    for i in indices[1:trend]:
+        action = pipeline.actions[i]
+        if action.pipeline_name != 'data.pandas.with_dataframe' or action.keywords.get('method') != 'dropna':
+            return None
+    return indices[0], indices[trend]
+
+
+def optimize_bbands_grid_func(combinations, context, parameters, df, column, metrics=None, max_bytes=2 ** 28):
+    """
+    布林带周期相同的多组参数一起优化，bbands及boll_trend按周期用bbands_grid_chunks、boll_trend_grid批量计算，其余方法逐组参数运行
+    结果与逐组调用optimize_func一致，df为None时使用共享内存中的K线数据
+    :param combinations: 周期相同的参数组合，由bbands_grid_tasks分组
+    :param max_bytes: 每批布林带结果的内存上限，超过时按带宽分批
+    :return: [(参数, 结果)]，记录性能时最后一项附带本批的性能记录
+    """
+    pipeline = _compiled_pipeline(parameters, context)
+    bbands_index, trend_index = bbands_grid_indices(pipeline, ['optimize'])
+    bbands_params = pipeline.actions[bbands_index].keywords
+    col = bbands_params.get('col', CANDLE_CLOSE_COLUMN)
+    period_index = parameters.parameter_names.index('period')
+    width_index = parameters.parameter_names.index('width')
+    scopes = ['optimize']
+    keep = [column, *metrics] if metrics else [column]
+    owned = df is None
+    df = _shared_data.to_dataframe() if df is None else df
+    if not owned and pipeline.required_columns(scopes, keep) is None:
+        df = df.copy()
+    profiler = PipelineProfiler(trace_memory=_profile_memory) if _profile_memory is not None else None
+
+    results = []
+    chunks = bbands_grid_chunks(df[col], [combinations[0][period_index]], [v[width_index] for v in combinations],
+                                bbands_params.get('ma_method', 'sma'), max_bytes)
+    while True:
+        chunk = _profiled_call(profiler, 'indicator.volatility.bbands_grid', next, chunks, None)
+        if chunk is None:
+            break
+        _, widths, bands = chunk
+        # 同一批的布林带被各组参数共用，与缓存的指标一样设为只读
+        for values in bands:
+            values.flags.writeable = False
+        bbm, bbu, bbl, bbb = bands
+        signal_long, signal_short = _profiled_call(profiler, 'signals.bollinger.boll_trend_grid', boll_trend_grid, df[col], bbm, bbu, bbl)
+        for j in range(len(widths)):
+            variables = combinations[len(results)]
+            bound = pipeline.bind(parameters.bind_params(variables))
+            _replace_action(bound, bbands_index, _assign_bbands, col=col,
+                            bands={'BBM': bbm[:, 0], 'BBU': bbu[:, 0, j], 'BBL': bbl[:, 0, j], 'BBB': bbb[:, 0, j]})
+            _replace_action(bound, trend_index, _assign_boll_trend, signals=(signal_long[:, 0, j], signal_short[:, 0, j]))
+            res = bound.process(df, scopes=scopes, profiler=profiler, keep=keep) if profiler else bound.process(df, scopes=scopes, keep=keep)
+            results.append((variables, _result_values(res, column, metrics)))
+    if profiler:
+        results[-1] += (profiler.records,)
+    return results
+
+
+@pipeline_columns(reads=lambda params: [params['col']], writes=['BBM', 'BBU', 'BBL', 'BBB'])
+def _assign_bbands(df, col, bands):
+    """
+    以批量计算的布林带代替bbands
+    """
+    for name, values in bands.items():
+        df[name] = values
+    return df
+
+
+@pipeline_columns(reads=[CANDLE_CLOSE_COLUMN, 'BBM', 'BBU', 'BBL'], writes=['signal_long', 'signal_short'])
+def _assign_boll_trend(df, signals):
+    """
+    以批量计算的信号代替boll_trend，之前的dropna删除了K线时前一根K线不同，仍调用boll_trend
+    """
+    if len(df) != len(signals[0]):
+        return boll_trend(df)
+    df['signal_long'], df['signal_short'] = signals
+    return df
+
+
+def _replace_action(pipeline, index, func, **kwargs):
+    """
+    替换管道中的方法，保留原方法的范围、名称等属性
+    """
+    action = pipeline.actions[index]
+    replaced = partial(func, **kwargs)
+    replaced.__dict__.update(action.__dict__)
+    pipeline.actions[index] = replaced
+
+
+def _profiled_call(profiler, name, func, *args):
+    return profiler.call(name, func, *args) if profiler else func(*args)
+
+
+def walk_forward_func(variables, context, parameters, df, column, windows):
+    """
+    单组参数的前推优化，整段K线只计算一次指标及信号，再在各时间区间上分别计算优化目标（管道最后一个方法）
+    区间之前的K线作为指标的预热数据，各折重叠的区间无需重复计算指标，df为None时使用共享内存中的K线数据
+    :param windows: [(开始时间, 结束时间)]，均包含
+    :return: (参数, [各区间的结果])
+    """
+    head, tail = _compiled_pipeline(parameters, context).bind(parameters.bind_params(variables)).split(['optimize'])
+    reads = tail.required_columns(keep=[column])
+    signals = _process_signals(head, df, None if reads is None else [CANDLE_DATETIME_COLUMN, *reads])
+    results = []
+    for window in _window_frames(signals, windows):
+        if window.empty:
+            results.append(np.nan)
+            continue
+        # 未声明读取列时会修改传入的数据，需复制；否则只取需要的列组成新的DataFrame
+        res = tail.process(window.copy() if reads is None else window, keep=[column])
+        results.append(_result_value(res, column))
+    return variables, results
+
+
+def walk_forward_curve_func(variables, context, parameters, df, curve_method, windows):
+    """
+    单组参数在各时间区间上的资金曲线，整段K线只计算一次指标及信号
+    :param curve_method: 资金曲线计算方法，参数与管道最后一个方法（优化目标）相同
+    :return: (参数, [各区间以K线时间为索引的资金曲线])
+    """
+    head, tail = _compiled_pipeline(parameters, context).bind(parameters.bind_params(variables)).split(['optimize'])
+    module_name, method_name = curve_method.rsplit('.', 1)
+    curve = getattr(importlib.import_module(module_name), method_name)
+    signals = _process_signals(head, df, None)
+    curves = []
+    for window in _window_frames(signals, windows):
+        if window.empty:
+            curves.append(pd.Series(dtype=np.float64))
+            continue
+        res = curve(window.copy(), **tail.actions[0].keywords)
+        curves.append(pd.Series(res[EQUITY_CURVE_COLUMN].to_numpy(), index=pd.DatetimeIndex(res[CANDLE_DATETIME_COLUMN])))
+    return variables, curves
+
+
+def _process_signals(pipeline, df, keep):
+    """
+    在整段K线上运行管道，不修改传入的数据
+    """
+    owned = df is None
+    df = _shared_data.to_dataframe() if df is None else df
+    if not owned and pipeline.required_columns(keep=keep) is None:
+        df = df.copy()
+    return pipeline.process(df, keep=keep)
+
+
+def _window_frames(df, windows):
+    """
+    按时间区间（均包含）切分
+    """
+    times = df[CANDLE_DATETIME_COLUMN]
+    for begin, end in windows:
+        yield df.iloc[times.searchsorted(begin, 'left'):times.searchsorted(end, 'right')]
+
+
+def _result_values(res, column, metrics):
+    """
+    不记录其他指标时只返回结果列的值，否则返回[column, *metrics]的数组
+    """
+    if not metrics:
+        return _result_value(res, column)
+    return np.array([_result_value(res, name) for name in [column, *metrics]], dtype=np.float64)
+
+
+def _result_value(res, column):
+    """
+    管道结果为优化目标dict（如future_equity_objectives）时直接取值，否则取最后一行
+    """
+    return res[column] if isinstance(res, dict) else res.iloc[-1][column]
+
+
+def _compiled_pipeline(parameters, context):
+    """
+    每个子进程只解析一次管道模板，之后每组参数只替换变化的参数
+    """
+    pipeline = _pipelines.get(parameters.key)
+    if pipeline is None:
+        pipeline = _pipelines[parameters.key] = Pipeline.build(parameters.actions, context)
+    return pipeline
+
+
+def multiprocessing_optimize(func, parameters, total, result_precision=0.01, *, initializer=None, initargs=(), chunksize=1, profiler=None, combinations=None,
+                             store=None, batched=False):
     """
     多进程优化
+    :param chunksize: 每次分配给子进程的连续参数组合数，相邻组合可以复用子进程内的指标缓存
+    :param profiler: 合并子进程返回的性能记录
+    :param combinations: 需要计算的参数组合，默认为全部参数组合
+    :param store: OptimizeResultStore，结果到达即写入
+    :param batched: combinations中每项为一批参数组合，func返回一批结果（如optimize_bbands_grid_func）
+    结果为数组（同时记录其他指标）时每个值占一列
     """
     result_exponent = number_exponent(result_precision)
+    combinations = parameters.parameter_product if combinations is None else combinations
     results = []
-    with Pool() as pool:
+    with Pool(initializer=initializer, initargs=initargs) as pool:
         with tqdm(total=total) as pbar:
-            for variables, result in pool.imap_unordered(func, parameters.parameter_product):
-                variables = parameters.auto_round(variables)
-                result = np.round(result, result_exponent)
-                results.append([*variables, result])
-                pbar.update()
-                pbar.set_description(f'parameters: {variables}, result: {result}')
+            for output in pool.imap_unordered(func, combinations, chunksize=chunksize):
+                for variables, result, *records in (output if batched else [output]):
+                    if profiler and records:
+                        profiler.merge(records[0])
+                    if store:
+                        store.append(variables, result)
+                    variables = parameters.auto_round(variables)
+                    result = np.round(result, result_exponent)
+                    results.append([*variables, *np.atleast_1d(result)])
+                    pbar.update()
+                    pbar.set_description(f'parameters: {variables}, result: {result}')
 
     return results
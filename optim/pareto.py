@@ -0,0 +1,36 @@
+import numpy as np
+
+
+def pareto_front(df, objectives):
+    """
+    帕累托前沿：没有被其他结果在所有目标上同时不差、且至少一个目标更好的结果
+    :param objectives: 目标列，列表时均为越大越好，或{列名: 'maximize' | 'minimize'}
+    :return: 前沿上的结果，按第一个目标排序，最好的在前
+    """
+    if not isinstance(objectives, dict):
+        objectives = {col: 'maximize' for col in objectives}
+    if not objectives:
+        raise RuntimeError('no objectives for pareto front')
+    signs = np.array([1 if target == 'maximize' else -1 for target in objectives.values()], dtype=np.float64)
+    values = df[list(objectives)].to_numpy(dtype=np.float64) * signs
+    # 无法计算的结果视为最差
+    values = np.where(np.isnan(values), -np.inf, values)
+    front = np.flatnonzero(_non_dominated(values))
+    front = front[np.argsort(-values[front, 0], kind='stable')]
+    return df.iloc[front].reset_index(drop=True)
+
+
+def _non_dominated(values):
+    """
+    按第一个目标从好到差依次检查，只需与已在前沿上的结果比较
+    """
+    order = np.lexsort(-values.T[::-1])
+    mask = np.zeros(len(values), dtype=bool)
+    front = np.empty((0, values.shape[1]))
+    for i in order:
+        v = values[i]
+        if len(front) and np.any(np.all(front >= v, axis=1) & np.any(front > v, axis=1)):
+            continue
+        mask[i] = True
+        front = np.vstack([front, v])
+    return mask
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import pickle
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+
+
+class OptimizeResultStore:
+    """
+    优化结果的SQLite存储，结果到达即写入，中断后重新运行可跳过已完成的参数组合
+    按运行指纹（数据、模板、优化参数及结果列的哈希）区分不同的优化，使用WAL模式，运行中也可以读取已有结果
+    """
+
+    def __init__(self, path, run_key, parameter_names=None, column=None, metrics=None, *, commit_interval=1.0):
+        """
+        :param metrics: 同时记录的其他指标名称，结果为[column, *metrics]的数组
+        :param commit_interval: 提交间隔（秒），中断时最多丢失这段时间内的结果
+        """
+        self.run_key = run_key
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS runs (run_key TEXT PRIMARY KEY, parameter_names TEXT, result_column TEXT, metric_names TEXT, '
+                           'created REAL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS results (run_key TEXT, variables TEXT, result REAL, metrics TEXT, PRIMARY KEY (run_key, variables))')
+        self._conn.execute('INSERT OR IGNORE INTO runs (run_key, parameter_names, result_column, metric_names, created) VALUES (?, ?, ?, ?, ?)',
+                           (run_key, json.dumps(parameter_names), column, json.dumps(metrics or []), time.time()))
+        self._conn.commit()
+        self._commit_interval = commit_interval
+        self._last_commit = time.monotonic()
+
+    def done(self):
+        """
+        已完成的参数组合：{variables_key(参数组合): 结果}，记录其他指标时结果为[column, *metrics]的数组
+        """
+        rows = self._conn.execute('SELECT variables, result, metrics FROM results WHERE run_key = ?', (self.run_key,))
+        return {variables: _result(result, metrics) for variables, result, metrics in rows}
+
+    def append(self, variables, result):
+        """
+        写入一组结果，按提交间隔批量提交
+        """
+        values = np.atleast_1d(result).astype(np.float64)
+        metrics = json.dumps(values[1:].tolist()) if len(values) > 1 else None
+        self._conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', (self.run_key, variables_key(variables), values[0].item(), metrics))
+        if time.monotonic() - self._last_commit >= self._commit_interval:
+            self.commit()
+
+    def commit(self):
+        self._conn.commit()
+        self._last_commit = time.monotonic()
+
+    def close(self):
+        self.commit()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def load_optimize_results(path, run_key=None):
+    """
+    读取已保存的优化结果，可在优化运行中读取，run_key为空时读取最近一次优化
+    """
+    with sqlite3.connect(path) as conn:
+        if run_key is None:
+            row = conn.execute('SELECT run_key FROM runs ORDER BY created DESC LIMIT 1').fetchone()
+            if row is None:
+                return pd.DataFrame()
+            run_key = row[0]
+        names, column, metric_names = conn.execute('SELECT parameter_names, result_column, metric_names FROM runs WHERE run_key = ?', (run_key,)).fetchone()
+        rows = conn.execute('SELECT variables, result, metrics FROM results WHERE run_key = ?', (run_key,)).fetchall()
+    names = json.loads(names)
+    metric_names = json.loads(metric_names) if metric_names else []
+    return pd.DataFrame([[*json.loads(variables), *np.atleast_1d(_result(result, metrics))] for variables, result, metrics in rows],
+                        columns=[*names, column, *metric_names])
+
+
+def optimize_run_key(df, parameters, context, column, metrics=None):
+    """
+    优化的指纹，数据、模板、优化参数、上下文、结果列或记录的其他指标任一变化即视为不同的优化
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    digest.update(df.columns.to_numpy().astype(str).tobytes())
+    digest.update(parameters.key.encode())
+    digest.update(pickle.dumps(context))
+    digest.update(column.encode())
+    if metrics:
+        digest.update(json.dumps(list(metrics)).encode())
+    return digest.hexdigest()
+
+
+def variables_key(variables):
+    """
+    参数组合的存储格式，numpy数值转换为python数值，浮点数可以无损还原
+    """
+    return json.dumps([v.item() if hasattr(v, 'item') else v for v in variables])
+
+
+def _nan(result):
+    # sqlite将NaN存为NULL
+    return float('nan') if result is None else result
+
+
+def _result(result, metrics):
+    if metrics is None:
+        return _nan(result)
+    return np.array([_nan(result), *json.loads(metrics)], dtype=np.float64)
+
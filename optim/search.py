@@ -0,0 +1,223 @@
+import math
+import warnings
+from functools import partial
+from multiprocessing import cpu_count
+from multiprocessing.pool import Pool
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import Matern, WhiteKernel
+from tqdm import tqdm
+from commons.math import number_exponent
+from data.shared_memory import SharedDataFrame
+from optim.optimizer import optimize_func, init_worker
+from optim.variant_parameters import VariantParameters
+from pipeline.profiler import active_profiler
+
+
+def random_search(df, target_template, variables, column, target='maximize', result_precision=0.01, n_iter=100, seed=None, shared_memory=False,
+                  indicator_cache_size=16):
+    """
+    在参数网格中随机抽取n_iter组参数评估
+    """
+    parameters = VariantParameters.from_template_file(target_template, variables)
+    context = parameters.extended_context(random_search.pipeline_context)
+    rng = np.random.default_rng(seed)
+    with _Evaluator(df, parameters, context, column, shared_memory, indicator_cache_size) as evaluator:
+        results = evaluator.evaluate(_sample_grid(parameters, n_iter, rng))
+    return _result_dataframe(parameters, column, target, result_precision, results)
+
+
+def successive_halving(df, target_template, variables, column, target='maximize', result_precision=0.01, n_candidates=81, eta=3, rungs=3, seed=None,
+                       shared_memory=False, indicator_cache_size=16):
+    """
+    逐级减半搜索：随机抽取n_candidates组参数，先在最近1/eta^(rungs-1)的K线上评估，每级保留最好的1/eta，窗口扩大eta倍，最后一级使用全部K线
+    """
+    parameters = VariantParameters.from_template_file(target_template, variables)
+    context = parameters.extended_context(successive_halving.pipeline_context)
+    rng = np.random.default_rng(seed)
+    with _Evaluator(df, parameters, context, column, shared_memory, indicator_cache_size) as evaluator:
+        results = _successive_halving(evaluator, _sample_grid(parameters, n_candidates, rng), eta, rungs, target)
+    return _result_dataframe(parameters, column, target, result_precision, results)
+
+
+def hyperband(df, target_template, variables, column, target='maximize', result_precision=0.01, eta=3, rungs=4, seed=None, shared_memory=False,
+              indicator_cache_size=16):
+    """
+    Hyperband：以不同的初始窗口及候选数运行多组逐级减半搜索，兼顾短窗口上表现不稳定的参数
+    """
+    parameters = VariantParameters.from_template_file(target_template, variables)
+    context = parameters.extended_context(hyperband.pipeline_context)
+    rng = np.random.default_rng(seed)
+    results = []
+    with _Evaluator(df, parameters, context, column, shared_memory, indicator_cache_size) as evaluator:
+        for s in reversed(range(rungs)):
+            # 第s组从最近1/eta^s的K线开始，共s+1级
+            n_candidates = math.ceil(rungs / (s + 1) * eta ** s)
+            results += _successive_halving(evaluator, _sample_grid(parameters, n_candidates, rng), eta, s + 1, target)
+    return _result_dataframe(parameters, column, target, result_precision, results)
+
+
+def surrogate_search(df, target_template, variables, column, target='maximize', result_precision=0.01, n_initial=20, n_iter=80, batch_size=None,
+                     pool_size=20000, seed=None, shared_memory=False, indicator_cache_size=16):
+    """
+    代理模型搜索：随机评估n_initial组参数后，用高斯过程拟合参数与结果，每批选择期望提升最大的batch_size组参数评估，共评估n_iter组
+    :param pool_size: 参数网格超过此数量时，只在随机抽取的pool_size组参数中选择
+    """
+    parameters = VariantParameters.from_template_file(target_template, variables)
+    context = parameters.extended_context(surrogate_search.pipeline_context)
+    rng = np.random.default_rng(seed)
+    batch_size = batch_size or cpu_count()
+    sign = 1 if target == 'maximize' else -1
+
+    candidates = _sample_grid(parameters, pool_size, rng)
+    lower, upper = np.array(parameters.variable_bounds, dtype=np.float64).T
+    scale = np.where(upper > lower, upper - lower, 1)
+    x_candidates = (np.array(candidates, dtype=np.float64) - lower) / scale
+    evaluated = np.zeros(len(candidates), dtype=bool)
+
+    results = []
+    with _Evaluator(df, parameters, context, column, shared_memory, indicator_cache_size) as evaluator:
+        batch = rng.choice(len(candidates), min(n_initial, n_iter, len(candidates)), replace=False)
+        while len(batch):
+            evaluated[batch] = True
+            results += evaluator.evaluate([candidates[i] for i in batch])
+            remains = np.flatnonzero(~evaluated)
+            size = min(batch_size, n_iter - len(results), len(remains))
+            if size <= 0:
+                break
+            x = (np.array([r[0] for r in results], dtype=np.float64) - lower) / scale
+            y = sign * np.array([r[1] for r in results], dtype=np.float64)
+            # 无法计算的结果视为最差
+            finite = np.isfinite(y)
+            y = np.where(finite, y, y[finite].min() if finite.any() else 0)
+            improvement = _expected_improvement(x, y, x_candidates[remains], seed)
+            batch = remains[np.argsort(-improvement, kind='stable')[:size]]
+    return _result_dataframe(parameters, column, target, result_precision, results)
+
+
+class _Evaluator:
+    """
+    在整个搜索过程中复用的进程池，子进程挂载K线数据，缓存已解析的管道及指标
+    """
+
+    def __init__(self, df, parameters, context, column, shared_memory, indicator_cache_size):
+        self._df = df
+        self._parameters = parameters
+        self._context = context
+        self._column = column
+        self._shared_memory = shared_memory
+        self._indicator_cache_size = indicator_cache_size
+        self._shared = None
+        self._pool = None
+        self._profiler = active_profiler()
+        self._cache = {}  # (参数, 窗口) -> 结果
+
+    @property
+    def bars(self):
+        return len(self._df)
+
+    def __enter__(self):
+        profile_memory = self._profiler.trace_memory if self._profiler else None
+        if self._shared_memory:
+            self._shared = SharedDataFrame.create(self._df)
+            initargs = (self._shared.meta, self._indicator_cache_size, profile_memory)
+        else:
+            initargs = (None, self._indicator_cache_size, profile_memory)
+        self._pool = Pool(initializer=init_worker, initargs=initargs)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._pool.terminate()
+        self._pool.join()
+        if self._shared:
+            self._shared.close()
+
+    def evaluate(self, combinations, window=None):
+        """
+        评估各组参数，已评估过的直接返回，window为只使用最近的K线数
+        :return: [(参数, 结果)]，顺序与combinations一致
+        """
+        combinations = [tuple(c) for c in combinations]
+        window = window if window and window < self.bars else None
+        todo = list(dict.fromkeys(c for c in combinations if (c, window) not in self._cache))
+        if todo:
+            func = partial(optimize_func, context=self._context, parameters=self._parameters, df=None if self._shared else self._df, column=self._column,
+                           window=window)
+            chunksize = max(1, len(todo) // (cpu_count() * 4))
+            with tqdm(total=len(todo), desc=f'bars: {window or self.bars}') as pbar:
+                for variables, result, *records in self._pool.imap_unordered(func, todo, chunksize=chunksize):
+                    if self._profiler and records:
+                        self._profiler.merge(records[0])
+                    self._cache[(tuple(variables), window)] = result
+                    pbar.update()
+        return [(c, self._cache[(c, window)]) for c in combinations]
+
+
+def _successive_halving(evaluator, candidates, eta, rungs, target):
+    """
+    逐级减半，返回最后一级（全部K线）的评估结果
+    """
+    for rung in range(rungs):
+        window = math.ceil(evaluator.bars / eta ** (rungs - 1 - rung))
+        results = evaluator.evaluate(candidates, window)
+        if rung == rungs - 1:
+            return results
+        keep = max(1, math.ceil(len(candidates) / eta))
+        candidates = [c for c, _ in _sort_results(results, target)[:keep]]
+    return []
+
+
+def _sort_results(results, target):
+    """
+    按结果排序，最好的在前，无法计算的结果排在最后
+    """
+    sign = -1 if target == 'maximize' else 1
+    return sorted(results, key=lambda r: (not np.isfinite(r[1]), sign * r[1] if np.isfinite(r[1]) else 0))
+
+
+def _sample_grid(parameters, n, rng):
+    """
+    从参数网格中不重复地随机抽取n组参数，网格较小时返回全部参数
+    """
+    values = parameters.variable_values
+    counts = [len(v) for v in values]
+    total = math.prod(counts)
+    if n >= total:
+        indices = np.arange(total)
+    elif total <= 10 ** 7:
+        indices = rng.choice(total, n, replace=False)
+    else:
+        indices = np.unique(rng.integers(0, total, n))
+    positions = np.unravel_index(indices, counts)
+    return [tuple(values[i][pos[k]] for i, pos in enumerate(positions)) for k in range(len(indices))]
+
+
+def _expected_improvement(x, y, x_candidates, seed):
+    """
+    高斯过程拟合已评估的参数，计算候选参数的期望提升（结果越大越好）
+    """
+    kernel = Matern(length_scale=np.full(x.shape[1], 0.2), nu=2.5) + WhiteKernel(noise_level=1e-3)
+    model = GaussianProcessRegressor(kernel=kernel, normalize_y=True, random_state=seed)
+    with warnings.catch_warnings():
+        # 结果起伏较大时核参数常落在边界上，不影响候选参数排序
+        warnings.simplefilter('ignore', ConvergenceWarning)
+        model.fit(x, y)
+    mean, std = model.predict(x_candidates, return_std=True)
+    std = np.maximum(std, 1e-12)
+    z = (mean - y.max()) / std
+    return (mean - y.max()) * norm.cdf(z) + std * norm.pdf(z)
+
+
+def _result_dataframe(parameters, column, target, result_precision, results):
+    """
+    与grid_optimizer.optimize相同格式的结果
+    """
+    result_exponent = number_exponent(result_precision)
+    rows = [[*parameters.auto_round(variables), np.round(result, result_exponent)] for variables, result in results]
+    res_df = pd.DataFrame(rows, columns=[*parameters.parameter_names, column])
+    res_df.drop_duplicates(subset=parameters.parameter_names, inplace=True)
+    res_df.sort_values(column, ascending=(target == 'minimize'), ignore_index=True, inplace=True)
+    return res_df
@@ -1,4 +1,6 @@
+import hashlib
 import math
+import pickle
 import numpy as np
 from itertools import product
 import yaml
@@ -15,20 +17,31 @@ class VariantParameters:
         self._template_actions = template['actions']
         self._variables, self._total = _parse_variables(self._template_actions, variables)
         self._variable_decimal_places = [number_exponent(v['step']) for v in self._variables]
+        # 模板及优化参数的指纹，子进程按此缓存已解析的管道
+        self._key = hashlib.blake2b(pickle.dumps((self._template_context, self._template_actions, variables)), digest_size=16).hexdigest()
 
     def generate_template(self, variables):
         """
-        根据传入参数生成管道配置
+        根据传入参数生成管道配置，不修改原模板
         """
-        self._check_variables(variables)
         template = self._template_actions.copy()
+        for idx, params in self.bind_params(variables).items():
+            template[idx] = {**template[idx], 'params': {**template[idx].get('params', {}), **params}}
+        return template
+
+    def bind_params(self, variables):
+        """
+        根据传入参数生成各方法需替换的参数：{方法序号: {参数名: 参数值}}
+        """
+        self._check_variables(variables)
+        params = {}
         for i, v in enumerate(variables):
             value = None
             conf = self._variables[i]
             if conf['type'] == 'range':
                 value = v
-            template[conf['index']]['params'][conf['name']] = value
-        return template
+            params.setdefault(conf['index'], {})[conf['name']] = value
+        return params
 
     def extended_context(self, another_context):
         """
@@ -57,6 +70,22 @@ class VariantParameters:
     def parameter_names(self):
         return [v['name'] for v in self._variables]
 
+    @property
+    def variable_methods(self):
+        return [v['method'] for v in self._variables]
+
+    @property
+    def variable_values(self):
+        return [v['values'] for v in self._variables]
+
+    @property
+    def variable_bounds(self):
+        return [(v['lower'], v['upper']) for v in self._variables]
+
+    @property
+    def variable_counts(self):
+        return [v['count'] for v in self._variables]
+
     @property
     def parameter_product(self):
         variables = [v['values'] for v in self._variables]
@@ -66,6 +95,10 @@ class VariantParameters:
     def total(self):
         return self._total
 
+    @property
+    def key(self):
+        return self._key
+
     @property
     def actions(self):
         return self._template_actions
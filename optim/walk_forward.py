@@ -0,0 +1,84 @@
+from contextlib import nullcontext
+from functools import partial
+from multiprocessing import cpu_count
+from multiprocessing.pool import Pool
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from commons.constants import CANDLE_DATETIME_COLUMN, EQUITY_CURVE_COLUMN
+from commons.math import number_exponent
+from data.shared_memory import SharedDataFrame
+from optim.optimizer import walk_forward_func, walk_forward_curve_func, init_worker
+from optim.variant_parameters import VariantParameters
+
+
+def walk_forward(df, target_template, variables, column, train_bars, test_bars, target='maximize', result_precision=0.01, anchored=False,
+                 curve_method='evaluation.engine.okex_numba.future_equity_curve', shared_memory=False, indicator_cache_size=16):
+    """
+    前推优化：按K线数切分训练、测试区间，每个训练区间选出最优参数，在紧随其后的测试区间上评估，拼接各测试区间的资金曲线
+    每组参数在整段K线上只计算一次指标及信号，所有区间共用，区间之前的K线作为指标的预热数据
+    :param train_bars: 训练区间K线数，anchored为True时为第一个训练区间的K线数
+    :param test_bars: 测试区间K线数，也是区间每次前移的K线数
+    :param anchored: 为True时训练区间始终从第一根K线开始，否则为固定长度的滚动区间
+    :param curve_method: 测试区间资金曲线的计算方法，参数与模板optimize范围最后一个方法（优化目标）相同
+    :return: {folds: 各区间的时间、最优参数及样本内、外结果, equity_curve: 拼接的样本外资金曲线}
+    """
+    parameters = VariantParameters.from_template_file(target_template, variables)
+    context = parameters.extended_context(walk_forward.pipeline_context)
+    folds = _folds(len(df), train_bars, test_bars, anchored)
+    times = df[CANDLE_DATETIME_COLUMN]
+    # 每折依次为训练、测试区间的(开始时间, 结束时间)
+    windows = [(times.iloc[begin], times.iloc[end - 1]) for fold in folds for begin, end in (fold[:2], fold[2:])]
+    test_windows = windows[1::2]
+    sign = 1 if target == 'maximize' else -1
+
+    with SharedDataFrame.create(df) if shared_memory else nullcontext() as shared:
+        initargs = (shared.meta if shared else None, indicator_cache_size)
+        data = None if shared else df
+        with Pool(initializer=init_worker, initargs=initargs) as pool:
+            # 所有参数组合在各区间上的结果
+            func = partial(walk_forward_func, context=context, parameters=parameters, df=data, column=column, windows=windows)
+            combinations, results = [], []
+            chunksize = max(1, parameters.total // (cpu_count() * 4))
+            for variables, result in tqdm(pool.imap_unordered(func, parameters.parameter_product, chunksize=chunksize), total=parameters.total):
+                combinations.append(tuple(variables))
+                results.append(result)
+            results = np.array(results, dtype=np.float64).reshape(len(combinations), len(folds), 2)
+
+            # 按训练区间结果选出每折的最优参数，无法计算的结果视为最差
+            train = sign * results[:, :, 0]
+            best = np.argmax(np.where(np.isfinite(train), train, -np.inf), axis=0)
+
+            # 最优参数在测试区间上的资金曲线
+            func = partial(walk_forward_curve_func, context=context, parameters=parameters, df=data, curve_method=curve_method, windows=test_windows)
+            chosen = [combinations[i] for i in dict.fromkeys(best)]
+            curves = dict(pool.imap_unordered(func, chosen))
+
+    result_exponent = number_exponent(result_precision)
+    rows, equity = [], []
+    level = 1.0
+    for k, (fold, idx) in enumerate(zip(folds, best)):
+        train_window, test_window = windows[2 * k], windows[2 * k + 1]
+        train_result, test_result = np.round(results[idx, k], result_exponent)
+        rows.append([k, *train_window, *test_window, *parameters.auto_round(combinations[idx]), train_result, test_result])
+        # 各测试区间的资金曲线从1开始，接在上一区间的期末资金之后
+        curve = curves[combinations[idx]][k] * level
+        if len(curve):
+            level = curve.iloc[-1]
+        equity.append(pd.DataFrame({CANDLE_DATETIME_COLUMN: curve.index, EQUITY_CURVE_COLUMN: curve.to_numpy(), 'fold': k}))
+
+    folds_df = pd.DataFrame(rows, columns=['fold', 'train_begin', 'train_end', 'test_begin', 'test_end', *parameters.parameter_names, f'train_{column}',
+                                           f'test_{column}'])
+    return {'folds': folds_df, EQUITY_CURVE_COLUMN: pd.concat(equity, ignore_index=True)}
+
+
+def _folds(bars, train_bars, test_bars, anchored):
+    """
+    切分区间：[(训练开始, 训练结束, 测试开始, 测试结束)]，均为K线序号，不含结束
+    """
+    train_bars, test_bars = int(train_bars), int(test_bars)
+    if train_bars <= 0 or test_bars <= 0:
+        raise RuntimeError(f'invalid walk forward bars, train: {train_bars}, test: {test_bars}')
+    if bars <= train_bars:
+        raise RuntimeError(f'not enough candles for walk forward, candles: {bars}, train: {train_bars}')
+    return [(0 if anchored else start - train_bars, start, start, min(start + test_bars, bars)) for start in range(train_bars, bars, test_bars)]
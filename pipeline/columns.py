@@ -0,0 +1,44 @@
+def pipeline_columns(reads=None, writes=()):
+    """
+    声明管道方法读取及写入的列，用于列裁剪模式
+    参数为列名列表，或以方法参数dict为参数、返回列名列表的函数；未声明读取列的方法视为读取所有列
+    """
+
+    def decorator(func):
+        func.pipeline_reads = reads
+        func.pipeline_writes = writes
+        return func
+
+    return decorator
+
+
+def action_columns(action):
+    """
+    管道方法（partial）读取及写入的列，读取所有列时reads为None
+    """
+    reads = getattr(action.func, 'pipeline_reads', None)
+    writes = getattr(action.func, 'pipeline_writes', ())
+    if callable(reads):
+        reads = reads(action.keywords)
+    if callable(writes):
+        writes = writes(action.keywords)
+    return (set(reads) if reads is not None else None), set(writes)
+
+
+def live_columns(actions, keep):
+    """
+    倒序推算每个方法执行前、后仍需要的列，None为需要所有列
+    :param keep: 处理完成后需要保留的列
+    :return: (执行第一个方法前需要的列, [每个方法执行后需要的列])
+    """
+    live = set(keep)
+    after = []
+    for action in reversed(actions):
+        after.append(live)
+        reads, writes = action_columns(action)
+        if reads is None or live is None:
+            live = None
+        else:
+            live = (live - writes) | reads
+    after.reverse()
+    return live, after
@@ -4,6 +4,8 @@ from functools import partial
 import pandas as pd
 import yaml
 from commons.logging import log
+from pipeline.columns import live_columns
+from pipeline.profiler import active_profiler
 
 
 class Pipeline:
@@ -27,22 +29,81 @@ class Pipeline:
         if scopes:
             func.pipeline_scopes = method.pipeline_scopes = scopes
         func.pipeline_multi = method.pipeline_multi = multi
+        func.pipeline_name = f'{module_name}.{method_name}'
         self.actions.append(func)
 
-    def process(self, df, scopes=None):
+    def bind(self, params):
+        """
+        替换部分方法的参数，返回新管道，其余方法与本管道共用，无需重新载入
+        :param params: {方法序号: {参数名: 参数值}}
+        """
+        pipeline = Pipeline(self.context)
+        pipeline.actions = list(self.actions)
+        for idx, kwargs in params.items():
+            action = self.actions[idx]
+            func = partial(action.func, **{**action.keywords, **kwargs})
+            func.__dict__.update(action.__dict__)
+            pipeline.actions[idx] = func
+        return pipeline
+
+    def split(self, scopes=None, index=-1):
+        """
+        按范围筛选方法后在index处拆分为前后两个管道，如将指标、信号计算与最后的资金曲线计算分开
+        """
+        actions = self._scoped_actions(scopes)
+        head, tail = Pipeline(self.context), Pipeline(self.context)
+        head.actions, tail.actions = actions[:index], actions[index:]
+        return head, tail
+
+    def process(self, df, scopes=None, *, profiler=None, keep=None):
         """
         处理数据
+        :param profiler: 记录每个方法的耗时及内存，默认使用当前进程正在记录的分析器
+        :param keep: 列裁剪模式，处理完成后只需要的列；按方法声明的读写列，每个方法执行后删除后续不再需要的列
+        """
+        actions = self._scoped_actions(scopes)
+        profiler = profiler or active_profiler()
+        if profiler:
+            with profiler.activate():
+                return self._process(df, actions, profiler, keep)
+        return self._process(df, actions, None, keep)
+
+    def required_columns(self, scopes=None, keep=None):
+        """
+        列裁剪模式下输入数据需要的列，None为需要所有列
+        """
+        return live_columns(self._scoped_actions(scopes), keep)[0] if keep is not None else None
+
+    def scoped_indices(self, scopes=None):
+        """
+        范围内方法的序号
         """
         if scopes and not isinstance(scopes, (set, list, tuple)):
             scopes = [scopes]
         if scopes and not isinstance(scopes, set):
             scopes = set(scopes)
-        for action in self.actions:
-            if not scopes or (scopes and action.pipeline_scopes and set.intersection(scopes, action.pipeline_scopes)):
-                if isinstance(df, (tuple, list)):
-                    df = action(*df)
-                else:
-                    df = action(df)
+        return [i for i, action in enumerate(self.actions) if
+                not scopes or (scopes and action.pipeline_scopes and set.intersection(scopes, action.pipeline_scopes))]
+
+    def _scoped_actions(self, scopes):
+        return [self.actions[i] for i in self.scoped_indices(scopes)]
+
+    def _process(self, df, actions, profiler, keep):
+        after = None
+        if keep is not None:
+            before, after = live_columns(actions, keep)
+            if before is not None and isinstance(df, pd.DataFrame):
+                # 只取需要的列组成新的DataFrame，各列引用原数据不复制，增删列不影响传入的数据
+                df = pd.DataFrame({col: df[col] for col in df.columns if col in before}, index=df.index, copy=False)
+        for i, action in enumerate(actions):
+            args = df if isinstance(df, (tuple, list)) else (df,)
+            if profiler:
+                df = profiler.call(action.pipeline_name, action, *args)
+            else:
+                df = action(*args)
+            if after is not None and after[i] is not None and isinstance(df, pd.DataFrame):
+                for col in [col for col in df.columns if col not in after[i]]:
+                    del df[col]
         return df
 
     @staticmethod
@@ -88,4 +149,4 @@ def flat_map(df, pipelines):
         actions = pipelines[key]
         pipeline = Pipeline.build(actions, flat_map.pipeline_context)
         results[key] = pipeline.process(df)
-    return
+    return results
@@ -0,0 +1,143 @@
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 当前进程中正在记录的分析器，嵌套的管道（如flat_map）自动记录到同一分析器
+_active = None
+
+
+def active_profiler():
+    """
+    获取当前进程中正在记录的分析器，没有则返回None
+    """
+    return _active
+
+
+class PipelineProfiler:
+    """
+    管道性能分析，记录每个方法的调用次数、墙钟时间、CPU时间、内存峰值增量及输出数据大小
+    记录为普通dict，可以从子进程返回后合并
+    """
+
+    def __init__(self, trace_memory=False):
+        """
+        :param trace_memory: 使用tracemalloc记录分配内存的峰值，开销较大
+        """
+        self.trace_memory = trace_memory
+        self.records = {}
+        self._peaks = []  # 嵌套调用的内存峰值栈
+
+    @contextmanager
+    def activate(self):
+        """
+        设置为当前进程的分析器
+        """
+        global _active
+        previous = _active
+        _active = self
+        started = self.trace_memory and not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        try:
+            yield self
+        finally:
+            if started:
+                tracemalloc.stop()
+            _active = previous
+
+    def call(self, name, func, *args):
+        """
+        调用方法并记录
+        """
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            current, outer_peak = tracemalloc.get_traced_memory()
+            self._peaks.append(outer_peak)
+            tracemalloc.reset_peak()
+        rss = _max_rss()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            result = func(*args)
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            rss_delta = _max_rss() - rss
+            traced = 0
+            if tracing:
+                # 内层调用会重置峰值，取本层及内层的最大值，并传递给外层
+                peak = max(tracemalloc.get_traced_memory()[1], self._peaks.pop())
+                traced = peak - current
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+        self.merge({name: {'calls': 1, 'wall_time': wall, 'cpu_time': cpu, 'max_rss_delta': rss_delta, 'traced_peak': traced,
+                           'output_bytes': _nbytes(result)}})
+        return result
+
+    def merge(self, records):
+        """
+        合并其他分析器（如子进程）的记录，次数及时间累加，内存及输出大小取最大值
+        """
+        for name, rec in records.items():
+            total = self.records.get(name)
+            if total is None:
+                self.records[name] = dict(rec)
+                continue
+            for key in ['calls', 'wall_time', 'cpu_time']:
+                total[key] += rec[key]
+            for key in ['max_rss_delta', 'traced_peak', 'output_bytes']:
+                total[key] = max(total[key], rec[key])
+
+    def to_dataframe(self):
+        """
+        汇总表，按墙钟时间降序，外层方法（如优化器）的时间包含内层方法
+        """
+        df = pd.DataFrame.from_dict(self.records, orient='index',
+                                    columns=['calls', 'wall_time', 'cpu_time', 'max_rss_delta', 'traced_peak', 'output_bytes'])
+        df.index.name = 'action'
+        return df.sort_values('wall_time', ascending=False)
+
+    def to_json(self, path=None):
+        """
+        输出为json字符串，指定路径时同时写入文件
+        """
+        text = json.dumps(self.records, indent=2)
+        if path:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+
+def _max_rss():
+    """
+    进程的最大常驻内存（字节），只能增长，差值为调用期间峰值的增量
+    """
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS单位为字节，Linux为KB
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _nbytes(obj):
+    """
+    输出数据的大小（字节），不统计python对象内容
+    """
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, (tuple, list)):
+        return sum(_nbytes(item) for item in obj)
+    if isinstance(obj, dict):
+        return sum(_nbytes(item) for item in obj.values())
+    return 0
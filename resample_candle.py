@@ -1,16 +1,27 @@
 import argparse
 from commons.argparse_commons import ParseKwargs
-from commons.io import load_by_ext, save_by_ext
-from data.candle import resample_candle_time_window
+from commons.io import ChunkWriter, iter_by_ext, load_by_ext, save_by_ext
+from data.candle import CandleResampler, resample_candle_time_window
 
 
-def resample(input_path, interval, in_params, *, drop_zero_volume, drop_zero_open):
+def resample(input_path, interval, in_params, *, drop_zero_volume, drop_zero_open, chunksize=None):
+    """
+    :param chunksize: 分块读取的行数，数据需按时间升序，不设置则整体载入
+    """
     in_params = in_params if in_params else {}
+    segments = input_path.split('.')
+    output_path = '.'.join(segments[0:-1]) + f'_RESAMPLE_{interval}.' + segments[-1]
     print('read: ', input_path)
+    if chunksize:
+        print('write: ', output_path)
+        resampler = CandleResampler(interval, drop_zero_volume, drop_zero_open)
+        with ChunkWriter(output_path, **in_params) as writer:
+            for df in iter_by_ext(input_path, chunksize, **in_params):
+                writer.write(resampler.update(df))
+            writer.write(resampler.flush())
+        return
     df = load_by_ext(input_path, **in_params)
     df = resample_candle_time_window(df, interval, drop_zero_volume, drop_zero_open)
-    segments = input_path.split('.')
-    output_path = '.'.join(segments[0:-1]) + f'_RESAMPLE_{interval}.' + segments[-1]
     print('write: ', output_path)
     save_by_ext(output_path, df, **in_params)
 
@@ -22,6 +33,8 @@ if __name__ == '__main__':
     parser.add_argument('--drop-zero-volume', action='store_true', help='drop zero volume')
     parser.add_argument('--drop-zero-open', action='store_true', help='drop zero open price')
     parser.add_argument('--input-config', nargs='*', action=ParseKwargs)
+    parser.add_argument('--chunksize', type=int, help='read and write in chunks of rows, for files larger than memory')
     args = parser.parse_args()
 
-    resample(args.input, args.interval, args.input_config, drop_zero_volume=args.drop_zero_volume, drop_zero_open=args.drop_zero_open)
+    resample(args.input, args.interval, args.input_config, drop_zero_volume=args.drop_zero_volume, drop_zero_open=args.drop_zero_open,
+             chunksize=args.chunksize)
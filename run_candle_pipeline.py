@@ -4,17 +4,25 @@ from pathlib import Path
 from commons.io import load_candle_by_ext
 from commons.datetime_utils import str_to_timezone
 from commons.dataframe_utils import filter_candle_dataframe_by_begin_end_offset_datetime
+from data.candle_store import CandleStore
 from pipeline.pipeline import Pipeline
+from pipeline.profiler import PipelineProfiler
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='run back testing')
     parser.add_argument('pipeline', help='pipeline template file')
-    parser.add_argument('input', help='history candle files')
+    parser.add_argument('input', help='history candle files, or <symbol>_<interval> when loading from candle store, e.g. BTC-USDT_5m')
     parser.add_argument('-s', '--scopes', nargs='+', help='pipeline scopes')
     parser.add_argument('-b', '--begin', help='begin date')
     parser.add_argument('-d', '--end', help='end date')
     parser.add_argument('-k', '--skip-days', default=0, help='skip days from data begin time, default: 0')
     parser.add_argument('-z', '--timezone', default='UTC', help='begin, end date timezone(not for candle begin time), default: UTC')
+    parser.add_argument('--store', help='partitioned parquet candle store root')
+    parser.add_argument('--exchange', help='exchange in candle store')
+    parser.add_argument('--market', help='market in candle store')
+    parser.add_argument('--compact', action='store_true', help='load candles as datetime64[ms] and float32 to halve memory')
+    parser.add_argument('--profile', action='store_true', help='print time and memory of each pipeline action, including optimizer workers')
+    parser.add_argument('--profile-output', help='save profile records to json file')
     args = parser.parse_args()
 
     # 载入管道
@@ -22,12 +30,19 @@ if __name__ == '__main__':
     # 时区
     pipeline.context['timezone'] = timezone = str_to_timezone(args.timezone)
     # 载入数据
-    data = load_candle_by_ext(args.input)
-    data = filter_candle_dataframe_by_begin_end_offset_datetime(data, args.begin, args.end, args.skip_days, tz=timezone)
+    if args.store:
+        # 从K线库载入，按开始、结束日期过滤分区及行组
+        symbol, interval = args.input.rsplit('_', 1)
+        data = CandleStore(args.store).load(symbol, interval, args.begin, args.end, exchange=args.exchange, market=args.market, tz=timezone)
+        data = filter_candle_dataframe_by_begin_end_offset_datetime(data, None, None, args.skip_days, tz=timezone)
+    else:
+        data = load_candle_by_ext(args.input, compact=args.compact)
+        data = filter_candle_dataframe_by_begin_end_offset_datetime(data, args.begin, args.end, args.skip_days, tz=timezone)
 
     # 运行回测
+    profiler = PipelineProfiler(trace_memory=True) if args.profile or args.profile_output else None
     start_time = timeit.default_timer()
-    res = pipeline.process(data, scopes=set(args.scopes) if args.scopes else None)
+    res = pipeline.process(data, scopes=set(args.scopes) if args.scopes else None, profiler=profiler)
     end_time = timeit.default_timer()
     elapse = end_time - start_time
 
@@ -43,5 +58,10 @@ if __name__ == '__main__':
     else:
         print('-' * 150)
         print(res)
+    if profiler:
+        print('-' * 150)
+        print(profiler.to_dataframe().to_string())
+        if args.profile_output:
+            profiler.to_json(args.profile_output)
     print('-' * 150)
     print(f'done, takes {elapse:.2f}s')
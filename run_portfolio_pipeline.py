@@ -0,0 +1,88 @@
+import argparse
+import glob
+import timeit
+from functools import partial
+from pathlib import Path
+import pandas as pd
+import pytz
+from commons.argparse_commons import ParseKwargs
+from commons.constants import EQUITY_CURVE_COLUMN
+from commons.io import load_candle_by_ext, save_by_ext
+from commons.datetime_utils import str_to_timezone
+from commons.dataframe_utils import filter_candle_dataframe_by_begin_end_offset_datetime
+from data.candle_store import CandleStore
+from evaluation.portfolio import portfolio_equity_curves, combine_equity_curves
+
+
+def load_file(files, symbol, *, begin=None, end=None, skip_days=0, tz=pytz.utc, compact=False):
+    """
+    从K线文件载入，symbol为文件名（不含扩展名）
+    """
+    data = load_candle_by_ext(files[symbol], compact=compact)
+    return filter_candle_dataframe_by_begin_end_offset_datetime(data, begin, end, skip_days, tz=tz)
+
+
+def load_store(root, interval, symbol, *, begin=None, end=None, skip_days=0, tz=pytz.utc, exchange=None, market=None):
+    """
+    从K线库载入
+    """
+    data = CandleStore(root).load(symbol, interval, begin, end, exchange=exchange, market=market, tz=tz)
+    return filter_candle_dataframe_by_begin_end_offset_datetime(data, None, None, skip_days, tz=tz)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='run back testing of multiple symbols and combine equity curves')
+    parser.add_argument('pipeline', help='pipeline template file')
+    parser.add_argument('inputs', nargs='+', help='history candle files or glob, or symbols or glob (e.g. *-USDT-SWAP) when loading from candle store')
+    parser.add_argument('-s', '--scopes', nargs='+', help='pipeline scopes')
+    parser.add_argument('-b', '--begin', help='begin date')
+    parser.add_argument('-d', '--end', help='end date')
+    parser.add_argument('-k', '--skip-days', default=0, help='skip days from data begin time, default: 0')
+    parser.add_argument('-z', '--timezone', default='UTC', help='begin, end date timezone(not for candle begin time), default: UTC')
+    parser.add_argument('-i', '--interval', help='candle interval in candle store, e.g. 5m')
+    parser.add_argument('--store', help='partitioned parquet candle store root')
+    parser.add_argument('--exchange', help='exchange in candle store')
+    parser.add_argument('--market', help='market in candle store')
+    parser.add_argument('--compact', action='store_true', help='load candles as datetime64[ms] and float32 to halve memory')
+    parser.add_argument('-w', '--workers', type=int, help='worker processes, default: cpu count')
+    parser.add_argument('--weights', nargs='+', action=ParseKwargs, help='capital allocation of symbols, e.g. BTC-USDT=2 ETH-USDT=1, default: equal')
+    parser.add_argument('--rebalance', action='store_true', help='rebalance to weights on every candle')
+    parser.add_argument('-o', '--output', help='save combined equity curves to file')
+    args = parser.parse_args()
+
+    timezone = str_to_timezone(args.timezone)
+    if args.store:
+        if not args.interval:
+            parser.error('--interval is required when loading from candle store')
+        store = CandleStore(args.store)
+        symbols = list(dict.fromkeys(s for pattern in args.inputs for s in store.symbols(args.interval, pattern, exchange=args.exchange, market=args.market)))
+        loader = partial(load_store, args.store, args.interval, begin=args.begin, end=args.end, skip_days=args.skip_days, tz=timezone,
+                         exchange=args.exchange, market=args.market)
+    else:
+        files = {Path(f).stem: f for pattern in args.inputs for f in sorted(glob.glob(pattern))}
+        symbols = list(files)
+        loader = partial(load_file, files, begin=args.begin, end=args.end, skip_days=args.skip_days, tz=timezone, compact=args.compact)
+    if not symbols:
+        parser.error(f'no symbols found: {args.inputs}')
+    print(f'symbols: {symbols}')
+
+    # 运行回测
+    start_time = timeit.default_timer()
+    curves = portfolio_equity_curves(args.pipeline, symbols, loader, scopes=set(args.scopes) if args.scopes else None, context={'timezone': timezone},
+                                     workers=args.workers)
+    weights = {symbol: float(weight) for symbol, weight in args.weights.items()} if args.weights else None
+    res = combine_equity_curves(curves, weights, rebalance=args.rebalance)
+    end_time = timeit.default_timer()
+    elapse = end_time - start_time
+
+    columns = [*symbols, EQUITY_CURVE_COLUMN]
+    equity = res[columns]
+    summary = pd.DataFrame({'final': equity.iloc[-1], 'max_drawdown': (equity / equity.cummax() - 1).min()})
+    print('-' * 150)
+    print(res)
+    print('-' * 150)
+    print(summary.to_string())
+    if args.output:
+        save_by_ext(args.output, res)
+    print('-' * 150)
+    print(f'done, takes {elapse:.2f}s')
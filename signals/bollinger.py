@@ -2,13 +2,15 @@ import numpy as np
 import pandas as pd
 from commons.constants import CANDLE_CLOSE_COLUMN
 from commons.debug import print_dataframe
+from pipeline.columns import pipeline_columns
 
 
+@pipeline_columns(reads=[CANDLE_CLOSE_COLUMN, 'BBM', 'BBU', 'BBL'], writes=['signal_long', 'signal_short'])
 def boll_trend(df):
     """
     布林线趋势信号，破上轨做多，下穿均线平多，破下轨做空，上穿均线平多
     """
-    df_s1 = df.shift(1)
+    df_s1 = df[[CANDLE_CLOSE_COLUMN, 'BBM', 'BBU', 'BBL']].shift(1)
 
     # 做多
     long_cond1 = df[CANDLE_CLOSE_COLUMN] > df['BBU']  # 收盘价 > 上轨
@@ -33,6 +35,7 @@ def boll_trend(df):
     return df
 
 
+@pipeline_columns(reads=[CANDLE_CLOSE_COLUMN, 'BBM', 'BBU', 'BBL'], writes=['signal_long', 'signal_short'])
 def boll_trend_with_safe_distance(df, safe_distance_pct):
     """
     布林趋势，加入价格与均线距离，在安全距离内开仓
@@ -70,3 +73,35 @@ def boll_trend_with_safe_distance(df, safe_distance_pct):
     df['signal_short'] = signal_short_safe
 
     return df
+
+
+def boll_trend_grid(close, bbm, bbu, bbl):
+    """
+    批量计算布林线趋势信号，信号规则与boll_trend一致
+    :param close: 收盘价序列，形状为(时间,)
+    :param bbm: 均线，形状为(时间, ...)，缺少的维度按上下轨广播
+    :param bbu: 上轨，形状为(时间, ...)
+    :param bbl: 下轨，形状与上轨相同
+    :return: (signal_long, signal_short)，形状与上轨相同
+    """
+    bbu = np.asarray(bbu, dtype=np.float64)
+    bbl = np.asarray(bbl, dtype=np.float64)
+    bbm = np.asarray(bbm, dtype=np.float64)
+    bbm = bbm.reshape(bbm.shape + (1,) * (bbu.ndim - bbm.ndim))
+    close = np.asarray(close, dtype=np.float64).reshape((-1,) + (1,) * (bbu.ndim - 1))
+
+    signal_long = np.where(_cross_condition(close > bbu, close <= bbu), 1.0, np.NaN)  # 破上轨做多
+    signal_long = np.where(_cross_condition(close < bbm, close >= bbm), 0.0, signal_long)  # 下破均线，平多
+    signal_short = np.where(_cross_condition(close < bbl, close >= bbl), -1.0, np.NaN)  # 破下轨，做空
+    signal_short = np.where(_cross_condition(close > bbm, close <= bbm), 0.0, signal_short)  # 上穿均线，平空
+
+    return signal_long, signal_short
+
+
+def _cross_condition(cond, prev_cond):
+    """
+    当前K线满足cond且前一根K线满足prev_cond，第一根K线没有前值，不产生信号
+    """
+    res = np.zeros_like(cond)
+    res[1:] = cond[1:] & prev_cond[:-1]
+    return res
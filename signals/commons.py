@@ -1,6 +1,8 @@
 from commons.constants import SIGNAL_COLUMN
+from pipeline.columns import pipeline_columns
 
 
+@pipeline_columns(reads=['signal_long', 'signal_short'], writes=lambda params: [params.get('column_name', SIGNAL_COLUMN)])
 def merge_long_short_signal(df, *, column_name=SIGNAL_COLUMN, fill_na=True, drop_original=False):
     """
     合并多空信号